@@ -0,0 +1,284 @@
+# Copyright 2022 Cristian Grosu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+from contextlib import contextmanager
+import functools
+import importlib
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import matplotlib
+matplotlib.use("Agg")
+
+from hierarchical_flow import get_data_for_groups, get_prediction_data
+import pipeline
+from utils.model_registry import get_model
+from utils.dataset import load_dataset
+from utils.lazy_import import imported_sources, resolve_handler
+from utils.synthetic import generate_dataset
+from utils.diagnostics import summarize_frame
+from utils.stan_models import HIERARCHICAL_QUESTIONS, PARAMETERIZATIONS
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+FLOWS = ["Q1", "Q2", "Q3_A", "Q3_B", "Q3_compare", "Q4_A", "Q4_B"]
+
+# the stages run their real handlers, the calls they make into these functions ("module:function" or "module:Class.method")
+# are timed as the sub-stages of the flow, whatever the handler spends elsewhere is reported as "other"
+SUBSTAGES = {
+    "csv_load": ["utils.dataset:load_dataset", "utils.sufficient_stats:compute_sufficient_statistics"],
+    "stan_build": ["utils.model_registry:CompiledModel.build"],
+    "sample": ["utils.sampling:sample_until_converged", "utils.simulation:parallel_simulate"],
+    "to_frame": ["utils.conjugate:SampledFit.to_frame"],
+    "summary": ["utils.diagnostics:summarize_frame"],
+    "plotting": [
+        "utils.plotter:plot_data", "utils.plotter:plot_data_and_fit", "utils.plotter:plot_data_and_fit_no_pooling_and_mix_pooling",
+        "utils.plotter:plot_predictions", "utils.plotter:plot_prior_predictive_check", "utils.rendering:PlotQueue.submit", "utils.rendering:PlotQueue.wait",
+    ],
+    "write_results": ["utils.write:write_results", "utils.write:write_summary", "utils.write:write_draws", "utils.extract:stream_draws"],
+}
+
+class StageTimer:
+    # accumulates wall time and peak traced memory per sub-stage of a flow, a sub-stage can be entered several times
+    # (e.g. once per species); a timed call made inside another one counts towards the outer one, so the sub-stages add up
+    def __init__(self):
+        self.stages = {}
+        self.active = False
+        self.total_seconds = 0.0
+        self.peak = 0
+
+    @contextmanager
+    def stage(self, name):
+        if self.active:
+            yield
+            return
+        self.active = True
+        self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            self.peak = max(self.peak, peak)
+            self.active = False
+            stats = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0, "peak_memory_mb": 0.0})
+            stats["seconds"] += seconds
+            stats["calls"] += 1
+            stats["peak_memory_mb"] = max(stats["peak_memory_mb"], peak / 2**20)
+
+    @contextmanager
+    def total(self):
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.total_seconds += time.perf_counter() - start
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+
+    def results(self):
+        stages = dict(self.stages)
+        stages["other"] = {"seconds": self.total_seconds - sum(stats["seconds"] for stats in self.stages.values())}
+        return {"stages": stages, "total_seconds": self.total_seconds, "peak_memory_mb": self.peak / 2**20, "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10}
+
+@contextmanager
+def timed_calls(timer, substages = SUBSTAGES):
+    # replaces the functions by timed wrappers for the duration, in their own module and in every loaded project module
+    # that imported them by name; the modules of the handlers must be imported before, or they would keep the wrappers
+    patched = []
+    try:
+        for name, specs in substages.items():
+            for spec in specs:
+                module_name, attribute = spec.split(":")
+                owner = importlib.import_module(module_name)
+                *classes, attribute = attribute.split(".")
+                for class_name in classes:
+                    owner = getattr(owner, class_name)
+                original = getattr(owner, attribute)
+                wrapper = _timed(original, timer, name)
+                owners = [owner] + ([] if classes else [module for module in list(sys.modules.values()) if module is not owner and _is_project_module(module) and getattr(module, attribute, None) is original])
+                for owner in owners:
+                    setattr(owner, attribute, wrapper)
+                    patched.append((owner, attribute, original))
+        yield
+    finally:
+        for owner, attribute, original in reversed(patched):
+            setattr(owner, attribute, original)
+
+def _timed(function, timer, name):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with timer.stage(name):
+            return function(*args, **kwargs)
+    return wrapper
+
+def _is_project_module(module):
+    path = getattr(module, "__file__", None)
+    return path is not None and os.path.abspath(path).startswith(ROOT + os.sep)
+
+def run_flows(flows, engine = "monte_carlo", parameterization = "centered"):
+    # the stages of the flows, and the upstream stages they read, run one after the other in this process as
+    # pipeline.run_stage runs them; the data is read from data/merged_data.csv under the working directory
+    data_df = load_dataset(pipeline.DATA_FILE).frame()
+    stages = pipeline.get_stages(data_df, engine = engine, parameterization = parameterization)
+    names = pipeline.select_stages(stages, flows)
+    for name in names:
+        resolve_handler(stages[name]["function"])
+        for module_name in imported_sources(stages[name]["function"]):
+            importlib.import_module(module_name)
+
+    timers, errors = {}, {}
+    for name in names:
+        question = name.split("/")[0]
+        if question in errors:
+            continue
+        timer = timers.setdefault(question, StageTimer())
+        try:
+            with timed_calls(timer), timer.total():
+                pipeline.run_stage(stages[name])
+        except Exception as e:
+            errors[question] = {"error": repr(e)}
+    return {question: errors.get(question) or timer.results() for question, timer in timers.items()}
+
+def compare_parameterizations(question, data_file, num_samples, parameterizations = PARAMETERIZATIONS):
+    # samples every parameterization of a hierarchical program on the same data and seed; the effective sample sizes are
+    # of the parameters all parameterizations share, per second of sampling and per 1000 gradient evaluations
+    dataset = load_dataset(data_file, cols = ["d18_O_w", "d18_O", "temperature", "species", "d18_O_w_sd", "d18_O_sd"])
+    if question == "Q3_B":
+        data = get_data_for_groups(dataset)
+    else:
+        specie = dataset.species[min(5, len(dataset.species) - 1)]
+        data = get_prediction_data(dataset, dataset.frame(species = specie), specie, measurement_error = question == "Q4_B")
+
+    results = {}
+    for parameterization in parameterizations:
+        try:
+            posterior = get_model(question = question, parameterization = parameterization).build(data, random_seed=1)
+            start = time.perf_counter()
+            fit = posterior.sample(num_chains=4, num_samples=num_samples)
+            seconds = time.perf_counter() - start
+        except Exception as e:
+            results[parameterization] = {"error": repr(e)}
+            continue
+        df = fit.to_frame()
+        cols = [col for col in df.columns if col.split(".")[0] in ["A", "B", "a", "b", "sigma", "sigma_a", "sigma_b"]]
+        summary = summarize_frame(df, fit.num_chains, cols = cols)
+        gradients = df["n_leapfrog__"].sum()
+        results[parameterization] = {
+            "sample_seconds": seconds,
+            "divergences": int(df["divergent__"].sum()),
+            "gradients": int(gradients),
+            "min_ess_bulk": float(summary["ess_bulk"].min()),
+            "min_ess_tail": float(summary["ess_tail"].min()),
+            "max_r_hat": float(summary["r_hat"].max()),
+            "min_ess_bulk_per_second": float(summary["ess_bulk"].min() / seconds),
+            "min_ess_bulk_per_1000_gradients": float(1000 * summary["ess_bulk"].min() / gradients),
+        }
+    return results
+
+def format_comparison(comparison):
+    lines = [f"{'program':<8} {'parameterization':<16} {'seconds':>8} {'divergent':>9} {'min bulk ESS':>12} {'min tail ESS':>12} {'max R-hat':>9} {'ESS/s':>8} {'ESS/1k grad':>11}"]
+    for question, results in comparison.items():
+        for parameterization, result in results.items():
+            if "error" in result:
+                lines.append(f"{question:<8} {parameterization:<16} {result['error']}")
+                continue
+            lines.append(f"{question:<8} {parameterization:<16} {result['sample_seconds']:>8.2f} {result['divergences']:>9} {result['min_ess_bulk']:>12.0f} {result['min_ess_tail']:>12.0f} {result['max_r_hat']:>9.3f} {result['min_ess_bulk_per_second']:>8.0f} {result['min_ess_bulk_per_1000_gradients']:>11.1f}")
+    return "\n".join(lines)
+
+def run_benchmarks(flows, sizes, species_counts, num_samples = 1000, imbalance = 0.0, engine = "monte_carlo", parameterization = "centered", output = "benchmark_results.json"):
+    data_file = os.path.join(ROOT, pipeline.DATA_FILE)
+    report = {"commit": git_commit(), "python": platform.python_version(), "machine": platform.machine(), "num_samples": num_samples, "imbalance": imbalance, "engine": engine, "parameterization": parameterization, "datasets": []}
+
+    datasets = [("merged_data", data_file, None, None)]
+    for num_rows in sizes:
+        for num_species in species_counts:
+            datasets.append((f"synthetic_N{num_rows}_J{num_species}", None, num_rows, num_species))
+
+    tracemalloc.start()
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as folder:
+        try:
+            for name, file_name, num_rows, num_species in datasets:
+                # the flows read data/merged_data.csv and write their plots, results and caches relative to the working directory
+                os.chdir(folder)
+                os.makedirs(os.path.join(name, "data"))
+                os.chdir(name)
+                if file_name is None:
+                    generate_dataset(pipeline.DATA_FILE, num_rows, num_species, imbalance = imbalance)
+                else:
+                    shutil.copy(file_name, pipeline.DATA_FILE)
+                num_rows_read = sum(1 for _ in open(pipeline.DATA_FILE)) - 1
+
+                # the pipeline parses the csv once before its stages, they all read the cached columns
+                start = time.perf_counter()
+                load_dataset(pipeline.DATA_FILE)
+                entry = {"name": name, "N": num_rows_read, "J": num_species, "cache_build_seconds": time.perf_counter() - start}
+
+                print(f"Benchmarking {', '.join(flows)} on {name}")
+                entry["flows"] = run_flows(flows, engine = engine, parameterization = parameterization)
+                report["datasets"].append(entry)
+        finally:
+            os.chdir(cwd)
+    tracemalloc.stop()
+
+    with open(output, "w") as f:
+        json.dump(report, f, indent = 2)
+    return report
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description = "Times every stage of the flows on the real data and on synthetic datasets")
+    parser.add_argument("--flows", nargs = "*", default = FLOWS, choices = FLOWS)
+    parser.add_argument("--skip-stan", action = "store_true", help = "only benchmark the flows whose stages do not sample with Stan")
+    parser.add_argument("--sizes", nargs = "*", type = int, default = [1000, 10000, 100000], help = "number of observations of the synthetic datasets")
+    parser.add_argument("--species", nargs = "*", type = int, default = [10, 100], help = "number of species of the synthetic datasets")
+    parser.add_argument("--imbalance", type = float, default = 0.0, help = "species frequencies decay as 1 / rank**imbalance")
+    parser.add_argument("--num-samples", type = int, default = 1000, help = "draws per chain of --compare, the flows sample until they converge")
+    parser.add_argument("--engine", default = "monte_carlo", choices = ["monte_carlo", "analytic", "check", "posterior", "stan"], help = "prediction engine of the Q4 questions")
+    parser.add_argument("--parameterization", default = "centered", choices = PARAMETERIZATIONS, help = "parameterization of the hierarchical Stan programs")
+    parser.add_argument("--output", default = "benchmark_results.json")
+    parser.add_argument("--compare", nargs = "*", choices = HIERARCHICAL_QUESTIONS, help = "compare the ESS per second of the parameterizations of these programs on the real data instead of timing the flows")
+    args = parser.parse_args()
+
+    if args.compare:
+        comparison = {question: compare_parameterizations(question, os.path.join(ROOT, pipeline.DATA_FILE), args.num_samples) for question in args.compare}
+        print(format_comparison(comparison))
+        with open(os.path.abspath(args.output), "w") as f:
+            json.dump({"commit": git_commit(), "num_samples": args.num_samples, "comparison": comparison}, f, indent = 2)
+        return
+
+    flows = args.flows
+    if args.skip_stan:
+        stages = pipeline.get_stages(load_dataset(os.path.join(ROOT, pipeline.DATA_FILE)).frame(), engine = args.engine, parameterization = args.parameterization)
+        flows = [flow for flow in flows if not any(stages[name]["stan"] for name in pipeline.select_stages(stages, [flow]))]
+    run_benchmarks(flows, args.sizes, args.species, num_samples = args.num_samples, imbalance = args.imbalance, engine = args.engine, parameterization = args.parameterization, output = os.path.abspath(args.output))
+
+if __name__ == "__main__":
+    main()
@@ -14,106 +14,168 @@
 
 
 from model_function import construct_model_function
-from utils.plotter import plot_data, plot_data_and_fit_no_pooling_and_mix_pooling, plot_predictions
-from utils.read import read_data, read_stan_results
+from utils.dataset import load_dataset
+from utils.read import open_draws, read_draws, read_stan_results
+from utils.predictive import analytic_predictive, check_predictive, posterior_predictive_draws, simulate_predictive, simulate_predictive_with_measurement_error, summarize_predictive_draws
 import numpy as np
-import stan
-from utils.stan_models import get_stan_code
-from utils.plotter import plot_data_and_fit
-from utils.write import write_results
+from utils.model_registry import compile_models, get_model
+from utils.sufficient_stats import compute_sufficient_statistics, get_collapsed_data, sufficient_statistics
+from utils.conjugate import ConjugatePosterior
+from utils.write import write_draws, write_results, write_summary
+from utils.simulation import parallel_simulate, spawn_seeds
+from utils.extract import stream_draws
 import os
-import arviz as av
-import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-def hierarchical_flow_Q3_A():
-    question = "Q3_A"
-    stan_code = get_stan_code( question= question)
+# matplotlib, the samplers and scipy (through the diagnostics) are imported by the flows that use them,
+# so resolving a handler, e.g. a Q4 prediction, does not pay for all of them
+
+def hierarchical_flow_Q3_A(workers = 1, num_chains = 4, engine = "stan", seed = 1):
+    from utils.rendering import PlotQueue
     
     # read data
-    data_df = read_data("data/merged_data.csv", cols = ["d18_O_w", "d18_O", "temperature", "species"])
+    dataset = load_dataset("data/merged_data.csv", cols = ["d18_O_w", "d18_O", "temperature", "species"])
     
-    # for each species we fit a model
-    for species in data_df["species"].unique():
-        data_df_species = data_df[data_df["species"] == species]
-        
-        data = get_data_for_species(data_df_species)
+    # every fit already runs its chains in parallel, so by default only as many species as the cores left allow
+    if workers is None:
+        workers = max(1, (os.cpu_count() or 1) // num_chains)
     
-        x = np.array(data_df_species["d18_O"]) - np.array(data_df_species["d18_O_w"])
-        y = data_df_species["temperature"]
-        
-        # plotting the data
-        plot_data(x, y, folder = os.path.join( question, species), title = "Temperature vs. d18_O for " + species)
+    # for each species we fit a model, with its own seed so the chains of different species are independent
+    jobs = {species: dataset.frame(species = species) for species in dataset.species}
+    seeds = dict(zip(dataset.species, spawn_seeds(seed, len(dataset.species))))
+    failures = {}
+    
+    if workers == 1:
+        # the plots of one species are rendered while the next species is sampled
+        with PlotQueue() as plots:
+            for species, data_df_species in jobs.items():
+                try:
+                    fit_species_Q3_A(species, data_df_species, num_chains = num_chains, engine = engine, plots = plots, seed = seeds[species])
+                except Exception as e:
+                    failures[species] = e
+    else:
+        if engine != "conjugate":
+            compile_models(["Q3_A_collapsed" if engine == "collapsed" else "Q3_A"])
+        with ProcessPoolExecutor(max_workers = workers) as executor:
+            futures = {executor.submit(fit_species_Q3_A, species, data_df_species, num_chains = num_chains, engine = engine, seed = seeds[species]): species for species, data_df_species in jobs.items()}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    failures[futures[future]] = e
     
-        # fitting the model
-        posterior = stan.build(stan_code, data=data, random_seed=1)
+    for species, error in failures.items():
+        print(f"Fitting the model for {species} failed: {error!r}")
+    return failures
+
+def fit_species_Q3_A(species, data_df_species, num_chains = 4, engine = "stan", plots = None, seed = 1):
+    from utils.plotter import plot_data, plot_data_and_fit
+    from utils.rendering import PlotQueue
+    from utils.sampling import sample_until_converged
     
-        fit = posterior.sample(num_chains=4, num_samples=100)
-        df = fit.to_frame()
-        print(av.summary(fit))        
-        print(df.describe().T)    
-       
-        write_results(df, file_name = "results.txt", cols = ["a", "b", "sigma"], folder=os.path.join( question, "species_" + species))
+    question = "Q3_A"
+    # without a queue the plots are rendered right away
+    plots = PlotQueue(workers = 0) if plots is None else plots
+
+    x = np.array(data_df_species["d18_O"]) - np.array(data_df_species["d18_O_w"])
+    y = data_df_species["temperature"]
+    
+    # plotting the data
+    plots.submit(plot_data, x, y, folder = os.path.join( question, species), title = "Temperature vs. d18_O for " + species)
 
-        plot_data_and_fit(x, y, df, construct_model_function(), folder = os.path.join( question, species), cols = ["a", "b", "sigma"], title = "Temperature vs. d18_O for " + species)
+    # fitting the model
+    posterior = build_species_posterior(data_df_species, engine = engine, seed = seed)
+
+    # easy species stop after the first increments, hard ones keep sampling up to the budget
+    fit = sample_until_converged(posterior, num_chains=num_chains, increment=100)
+    df = fit.to_frame()
+    print(fit.summary)
+   
+    write_draws(df, cols = [col for col in df.columns if not col.endswith("__")], folder = os.path.join( question, "species_" + species), num_chains = fit.num_chains)
+    write_summary(fit.summary, file_name = "results.txt", cols = ["a", "b", "sigma"], folder=os.path.join( question, "species_" + species))
+
+    plots.submit(plot_data_and_fit, x, y, df, construct_model_function(), folder = os.path.join( question, species), cols = ["a", "b", "sigma"], title = "Temperature vs. d18_O for " + species)
    
-def hierarchical_flow_Q3_B():
+def hierarchical_flow_Q3_B(engine = "stan", parameterization = "centered"):
+    from utils.gibbs import GibbsPosterior
+    from utils.plotter import plot_data, plot_data_and_fit_no_pooling_and_mix_pooling
+    from utils.rendering import PlotQueue
+    from utils.sampling import sample_until_converged
+    
     question = "Q3_B"        
-    stan_code = get_stan_code( question= question)
     
     # read data
-    data_df = read_data("data/merged_data.csv", cols = ["d18_O_w", "d18_O", "temperature", "species"])
+    dataset = load_dataset("data/merged_data.csv", cols = ["d18_O_w", "d18_O", "temperature", "species"])
     
     # for each species we fit a model
-    species = data_df["species"].unique()
-   
-   
-   
-    data = {
-        "J": len(species),
-        "N": len(data_df),
-        "group": [i+1 for i in range(len(species)) for j in range(len(data_df[data_df["species"] == species[i]]))],
-        "d18_O_w": np.array(data_df["d18_O_w"]),
-        "d18_O_c": np.array(data_df["d18_O"]),
-        "T": np.array(data_df["temperature"]),
-    }
+    species = dataset.species
     
-    # fitting the model
-    posterior = stan.build(stan_code, data=data, random_seed=1)
-    fit = posterior.sample()
+    # fitting the model, the collapsed model only sees the per species sufficient statistics of the data
+    if engine == "collapsed":
+        stats = compute_sufficient_statistics("data/merged_data.csv").reindex(species)
+        posterior = get_model(question = "Q3_B_collapsed").build(get_collapsed_data(stats), random_seed=1)
+    elif engine == "gibbs":
+        # the Gibbs sampler needs no compilation, the no pooling fits below then use the exact conjugate posterior
+        stats = compute_sufficient_statistics("data/merged_data.csv").reindex(species)
+        posterior = GibbsPosterior(stats, random_seed=1)
+    else:
+        posterior = get_model(question = question, parameterization = parameterization).build(get_data_for_groups(dataset), random_seed=1)
+    fit = sample_until_converged(posterior, num_chains=4, increment=250)
     model_df = fit.to_frame()
-    print(av.summary(fit))        
-    print(model_df.describe().T)
+    print(fit.summary)
+    
+    # keep the raw draws, the Q4 predictions reuse them instead of refitting
+    write_draws(model_df, cols = [col for col in model_df.columns if not col.endswith("__")], folder = question, num_chains = fit.num_chains)
     
-    for j in range(len(species)):
-        specie = species[j]
-        data_df_specie = data_df[data_df["species"] == specie]
+    # the plots of one species are rendered while the next species is sampled
+    seeds = spawn_seeds(1, len(species))
+    with PlotQueue() as plots:
+        for j in range(len(species)):
+            specie = species[j]
+            data_df_specie = dataset.frame(species = specie)
         
-        x = np.array(data_df_specie["d18_O"]) - np.array(data_df_specie["d18_O_w"])
-        y = data_df_specie["temperature"]
-        # plotting the data
-        plot_data(x, y, folder = os.path.join(question, specie), title = "Temperature vs. d18_O for " + specie)
+            x = np.array(data_df_specie["d18_O"]) - np.array(data_df_specie["d18_O_w"])
+            y = data_df_specie["temperature"]
+            # plotting the data
+            plots.submit(plot_data, x, y, folder = os.path.join(question, specie), title = "Temperature vs. d18_O for " + specie)
     
-        # get the data about the specific specie from df 
-        cols = [f"a.{(j+1)}", f"b.{(j+1)}", "sigma"]
-        df_mix_pooling = model_df[cols]        
+            # get the data about the specific specie from df 
+            cols = [f"a.{(j+1)}", f"b.{(j+1)}", "sigma"]
+            df_mix_pooling = model_df[cols]        
 
-        write_results(df_mix_pooling, file_name = "results.txt", cols = cols, folder=os.path.join( question, "species_" + specie))
+            write_summary(fit.summary, file_name = "results.txt", cols = cols, folder=os.path.join( question, "species_" + specie))
     
-        data = get_data_for_species(data_df_specie)       
-        df_no_pooling = stan.build(get_stan_code(question="Q3_A"), data=data, random_seed=1).sample(num_chains=4, num_samples=100).to_frame()
+            df_no_pooling = build_species_posterior(data_df_specie, engine = "conjugate" if engine == "gibbs" else engine, seed = seeds[j]).sample(num_chains=4, num_samples=100).to_frame()
+        
+            plots.submit(plot_data_and_fit_no_pooling_and_mix_pooling, x, y, df_no_pooling, df_mix_pooling, construct_model_function(cols = cols), folder = os.path.join( question, specie), title = "Temperature vs. d18_O for " + specie, cols = cols)
         
-        plot_data_and_fit_no_pooling_and_mix_pooling(x, y, df_no_pooling, df_mix_pooling, construct_model_function(cols = cols), folder = os.path.join( question, specie), title = "Temperature vs. d18_O for " + specie, cols = cols)
+def hierarchical_flow_Q3_compare(engine = "stan", num_folds = 10, workers = None):
+    from utils.cross_validation import compare_by_species, cross_validate
+    
+    question = "Q3_compare"
+    
+    # read data
+    data_df = load_dataset("data/merged_data.csv", cols = ["d18_O_w", "d18_O", "temperature", "species"]).frame()
+    
+    # expected log predictive density of the no pooling and partial pooling models, PSIS-LOO with K-fold refits where it is unreliable
+    pointwise, pareto_k, refitted = cross_validate(data_df, engine = engine, num_folds = num_folds, workers = workers)
+    df = compare_by_species(pointwise, pareto_k, data_df["species"], refitted = refitted)
+    print(df)
+    
+    write_results(df, file_name = "model_comparison.txt", cols = list(df.columns), folder = question, described = True)
+    return df
         
-def hierarchical_flow_Q4_A():
+def hierarchical_flow_Q4_A(engine = "monte_carlo", seed = 1, workers = None, parameterization = "centered"):
+    from utils.plotter import plot_data, plot_predictions
+    
     question = "Q4_A"
-    stan_code = get_stan_code( question= question)
     
     # read data
-    data_df = read_data("data/merged_data.csv", cols = ["d18_O_w", "d18_O", "temperature", "species", "d18_O_w_sd", "d18_O_sd"])
+    dataset = load_dataset("data/merged_data.csv", cols = ["d18_O_w", "d18_O", "temperature", "species", "d18_O_w_sd", "d18_O_sd"])
     
-    species = data_df["species"].unique()
+    species = dataset.species
     specie = species[5]
-    data_df_species = data_df[data_df["species"] == specie]
+    data_df_species = dataset.frame(species = specie)
     
     d18_O_w = np.array(data_df_species["d18_O_w"])
     d18_O_c = np.array(data_df_species["d18_O"])
@@ -123,22 +185,19 @@ def hierarchical_flow_Q4_A():
     sigma = 2.191
     sigma_a = 1.429
     sigma_b = 0.478
+    num_param_draws = 50
     
-    df = pd.DataFrame()
-    for i in range(len(d18_O_w)):
-        y_pred = np.array([])
-        a = np.random.normal(a_m, sigma_a, size = 50)
-        b = np.random.normal(b_m, sigma_b, size = 50)
-        
-        for j in range(len(a)):
-            y_pred = np.concatenate((y_pred, np.random.normal(a[j] + b[j] * (d18_O_c[i] - d18_O_w[i]), sigma, size = 1000)))
-        
-        y_pred_mean = np.mean(y_pred)
-        y_pred_std = np.std(y_pred)
-        df[f"y_{i}"] = [y_pred_mean, y_pred_std]
-    
-    df = df.T
-    df.columns = ["mean", "std"]
+    df = run_predictive_engine(
+        engine,
+        monte_carlo = lambda: parallel_simulate(
+            simulate_predictive, {"delta": d18_O_c - d18_O_w}, seed = seed, workers = workers,
+            a_mean = a_m, a_std = sigma_a, b_mean = b_m, b_std = sigma_b, sigma = sigma, num_param_draws = num_param_draws, num_noise_draws = 1000,
+        ),
+        analytic = lambda: analytic_predictive(d18_O_c, d18_O_w, 0, 0, a_m, sigma_a, b_m, sigma_b, sigma),
+        posterior = lambda: predict_from_posterior(data_df_species, species, seed = seed),
+        stan = lambda: predict_with_stan(question, dataset, data_df_species, specie, seed = seed, parameterization = parameterization),
+        num_param_draws = num_param_draws,
+    )
     print(df)
     
     x = np.array(data_df_species["d18_O"]) - np.array(data_df_species["d18_O_w"])
@@ -150,16 +209,17 @@ def hierarchical_flow_Q4_A():
         
     write_results(df, file_name = "results.txt", cols = ["mean", "std"], folder=os.path.join( question, "species_" + specie), described=True)
  
-def hierarchical_flow_Q4_B():
+def hierarchical_flow_Q4_B(engine = "monte_carlo", seed = 1, workers = None, parameterization = "centered"):
+    from utils.plotter import plot_predictions
+    
     question = "Q4_B"
-    stan_code = get_stan_code( question= question)
     
     # read data
-    data_df = read_data("data/merged_data.csv", cols = ["d18_O_w", "d18_O", "temperature", "species", "d18_O_w_sd", "d18_O_sd"])
+    dataset = load_dataset("data/merged_data.csv", cols = ["d18_O_w", "d18_O", "temperature", "species", "d18_O_w_sd", "d18_O_sd"])
     
-    species = data_df["species"].unique()
+    species = dataset.species
     specie = species[5]
-    data_df_species = data_df[data_df["species"] == specie]
+    data_df_species = dataset.frame(species = specie)
     
     d18_O_w = np.array(data_df_species["d18_O_w"])
     d18_O_c = np.array(data_df_species["d18_O"])
@@ -170,30 +230,21 @@ def hierarchical_flow_Q4_B():
     sigma_a = 1.429
     sigma_b = 0.478
     
-    df = pd.DataFrame()
-    
-    
+    d18_O_w_std = np.array(data_df_species["d18_O_w_sd"])
+    d18_O_c_std = np.array(data_df_species["d18_O_sd"])
+    num_param_draws = 50
     
-    for i in range(len(d18_O_w)):
-        d18_O_w_std = np.array(data_df_species["d18_O_w_sd"])[i]
-        d18_O_c_std = np.array(data_df_species["d18_O_sd"])[i]
-        
-        a = np.random.normal(a_m, sigma_a, size = 50)
-        b = np.random.normal(b_m, sigma_b, size = 50)
-        y_pred = np.array([])
-        
-        for j in range(len(a)):         
-            d18_O_w_i = np.random.normal(d18_O_w[i], d18_O_w_std, size = 50)
-            d18_O_c_i = np.random.normal(d18_O_c[i], d18_O_c_std, size = 50)
-            for k in range(len(d18_O_w_i)):
-                y_pred = np.concatenate((y_pred, np.random.normal(a[j] + b[j] * (d18_O_c_i[k] - d18_O_w_i[k]), sigma, size = 100)))
-       
-        y_pred_mean = np.mean(y_pred)
-        y_pred_std = np.std(y_pred)
-        df[f"y_{i}"] = [y_pred_mean, y_pred_std]
-    
-    df = df.T
-    df.columns = ["mean", "std"]
+    df = run_predictive_engine(
+        engine,
+        monte_carlo = lambda: parallel_simulate(
+            simulate_predictive_with_measurement_error, {"d18_O_c": d18_O_c, "d18_O_w": d18_O_w, "d18_O_c_sd": d18_O_c_std, "d18_O_w_sd": d18_O_w_std}, seed = seed, workers = workers,
+            a_mean = a_m, a_std = sigma_a, b_mean = b_m, b_std = sigma_b, sigma = sigma, num_param_draws = num_param_draws, num_measurement_draws = 50, num_noise_draws = 100,
+        ),
+        analytic = lambda: analytic_predictive(d18_O_c, d18_O_w, d18_O_c_std, d18_O_w_std, a_m, sigma_a, b_m, sigma_b, sigma),
+        posterior = lambda: predict_from_posterior(data_df_species, species, measurement_error = True, seed = seed),
+        stan = lambda: predict_with_stan(question, dataset, data_df_species, specie, measurement_error = True, seed = seed, parameterization = parameterization),
+        num_param_draws = num_param_draws,
+    )
     print(df)
     
     x = np.array(data_df_species["d18_O"]) - np.array(data_df_species["d18_O_w"])
@@ -205,6 +256,75 @@ def hierarchical_flow_Q4_B():
 
     write_results(df, file_name = "results.txt", cols = ["mean", "std"], folder=os.path.join( question, "species_" + specie), described=True)
     
+def run_predictive_engine(engine, monte_carlo, analytic, posterior = None, stan = None, num_param_draws = 50):
+    # "check" keeps the simulated predictions but reports how far they are from the exact moments
+    if engine == "monte_carlo":
+        return monte_carlo()
+    if engine == "analytic":
+        return analytic()
+    if engine == "posterior" and posterior is not None:
+        return posterior()
+    if engine == "stan" and stan is not None:
+        return stan()
+    if engine == "check":
+        df = monte_carlo()
+        print(check_predictive(analytic(), df, num_param_draws = num_param_draws))
+        return df
+    raise ValueError(f"Unknown prediction engine {engine}")
+
+def predict_with_stan(question, dataset, data_df_species, specie, measurement_error = False, seed = 1, parameterization = "centered"):
+    # fits the Q4 program and keeps only the y_new predictions, as float32 in the draw store,
+    # the draws of the other generated quantities are never copied out of the fit
+    data = get_prediction_data(dataset, data_df_species, specie, measurement_error = measurement_error)
+    fit = get_model(question = question, parameterization = parameterization).build(data, random_seed = seed).sample(num_chains = 4, num_samples = 1000)
+    store = stream_draws(fit, include = ["y_new"], folder = os.path.join(question, "species_" + specie))
+    draws = open_draws(store)
+    y_pred = np.stack([draws[f"y_new.{k + 1}"].reshape(-1) for k in range(data["K"])], axis = 1)
+    return summarize_predictive_draws(y_pred)
+
+def get_prediction_data(dataset, data_df_species, specie, measurement_error = False):
+    data = get_data_for_groups(dataset)
+    data.update({
+        "K": len(data_df_species),
+        "specie": list(dataset.species).index(specie) + 1,
+        "d18_O_w_new": np.array(data_df_species["d18_O_w"]),
+        "d18_O_c_new": np.array(data_df_species["d18_O"]),
+    })
+    if measurement_error:
+        # the program takes one measurement error for all new observations
+        data["d18_O_c_std"] = float(np.mean(data_df_species["d18_O_sd"]))
+        data["d18_O_w_std"] = float(np.mean(data_df_species["d18_O_w_sd"]))
+    return data
+
+def predict_from_posterior(data_df, species, measurement_error = False, store = os.path.join("results", "Q3_B", "draws"), seed = None):
+    # predicts every row of data_df in one go, species that were not part of the Q3_B fit get a new species draw
+    draws = read_draws(store, cols = ["A", "B", "sigma", "sigma_a", "sigma_b"] + [f"{param}.{j + 1}" for param in ["a", "b"] for j in range(len(species))])
+    species_index = {specie: j + 1 for j, specie in enumerate(species)}
+    group = np.array([species_index.get(specie, 0) for specie in data_df["species"]])
+    
+    d18_O_c_std = np.array(data_df["d18_O_sd"]) if measurement_error else 0
+    d18_O_w_std = np.array(data_df["d18_O_w_sd"]) if measurement_error else 0
+    
+    y_pred = posterior_predictive_draws(draws, np.array(data_df["d18_O"]), np.array(data_df["d18_O_w"]), group, d18_O_c_std, d18_O_w_std, rng = np.random.default_rng(seed))
+    return summarize_predictive_draws(y_pred)
+
+def build_species_posterior(data_df_species, engine = "stan", seed = 1):
+    if engine == "collapsed":
+        return get_model(question = "Q3_A_collapsed").build(get_collapsed_data(sufficient_statistics(data_df_species).iloc[0]), random_seed=seed)
+    if engine == "conjugate":
+        return ConjugatePosterior(sufficient_statistics(data_df_species).iloc[0], random_seed=seed)
+    return get_model(question = "Q3_A").build(get_data_for_species(data_df_species), random_seed=seed)
+
+def get_data_for_groups(dataset):
+    return {
+        "J": len(dataset.species),
+        "N": dataset.num_rows,
+        "group": dataset.group,
+        "d18_O_w": np.array(dataset["d18_O_w"]),
+        "d18_O_c": np.array(dataset["d18_O"]),
+        "T": np.array(dataset["temperature"]),
+    }
+
 def get_data_for_species(data_df_species):
     return {
             "N": len(data_df_species),
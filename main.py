@@ -13,24 +13,42 @@
 # limitations under the License.
 
 
-from hierarchical_flow import hierarchical_flow_Q3_A, hierarchical_flow_Q3_B, hierarchical_flow_Q4_A, hierarchical_flow_Q4_B
-from simple_flow import simple_flow_Q1, simple_flow_Q2
+import argparse
 
-QUESTION = "Q4_B"
+from utils.lazy_import import ImportTimer
+from utils.stan_models import PARAMETERIZATIONS
 
-def main():
-    question_solvers = {
-        "Q1": simple_flow_Q1,
-        "Q2": simple_flow_Q2,
-        "Q3_A": hierarchical_flow_Q3_A,
-        "Q3_B": hierarchical_flow_Q3_B,
-        "Q4_A": hierarchical_flow_Q4_A,
-        "Q4_B": hierarchical_flow_Q4_B
-    }
-    if QUESTION in question_solvers:
-        question_solvers[QUESTION]()
-    else:
-        print("Question not implemented")
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Runs the assignment questions, skipping the ones whose inputs did not change")
+    parser.add_argument("targets", nargs = "*", help = "questions (Q1, Q2, Q3_A, Q3_B, Q3_compare, Q4_A, Q4_B) or single stages (Q3_A/<species>), all by default")
+    parser.add_argument("--jobs", type = int, default = 1, help = "number of stages run concurrently")
+    parser.add_argument("--force", action = "store_true", help = "rerun the selected stages even if their inputs did not change")
+    parser.add_argument("--engine", default = "monte_carlo", choices = ["monte_carlo", "analytic", "check", "posterior", "stan"], help = "prediction engine of the Q4 questions")
+    parser.add_argument("--parameterization", default = "centered", choices = PARAMETERIZATIONS, help = "parameterization of the hierarchical Stan programs (Q3_B, and Q4 with the stan engine)")
+    parser.add_argument("--purge-cache", nargs = "?", type = float, const = 30, default = None, metavar = "DAYS", help = "delete the compiled Stan models not used for DAYS days (30 by default) and exit")
+    parser.add_argument("--max-cached-models", type = int, default = None, help = "with --purge-cache, also delete all but this many most recently used models")
+    parser.add_argument("--import-times", action = "store_true", help = "report how long the slowest module imports took")
+    args = parser.parse_args(argv)
+    
+    if args.purge_cache is not None:
+        from utils.model_registry import purge_model_cache
+        purged = purge_model_cache(max_age_days = args.purge_cache, max_entries = args.max_cached_models)
+        print(f"Purged {len(purged)} compiled models")
+        return 0
+    
+    # the flows and their dependencies (stan, arviz, matplotlib) are only imported by the stages that run
+    timer = ImportTimer().install() if args.import_times else None
+    try:
+        from pipeline import run_pipeline
+        done, failed = run_pipeline(args.targets, jobs = args.jobs, force = args.force, engine = args.engine, parameterization = args.parameterization)
+    except ValueError as e:
+        print(e)
+        return 1
+    finally:
+        if timer is not None:
+            timer.uninstall()
+            print(timer.report())
+    return 1 if failed else 0
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    exit(main())
@@ -12,8 +12,52 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from functools import partial
+
+import numpy as np
+
+def linear_model_function(x, params, cols = ["a", "b"]):
+    a, b = params[cols[0]], params[cols[1]]
+    return a + b * x
+
 def construct_model_function(cols = ["a", "b"]):
-    def model_function(x, params):
-        a, b = params[cols[0]], params[cols[1]]
-        return a + b * x
-    return model_function
+    # a partial of a module level function, so it can be sent to the plot workers
+    return partial(linear_model_function, cols = cols)
+
+
+def evaluate_draws(model_function, x, draws, cols = ["a", "b"], reduce = None, quantiles = (0.05, 0.5, 0.95), dtype = np.float64, memory_budget_mb = 64):
+    # evaluates the model for every draw and every x in one broadcast, returns the draws x inputs matrix
+    # or, with reduce = "mean", "std" or "quantile", its reduction over the draws;
+    # the inputs are processed in column blocks of at most memory_budget_mb, so a reduction never holds the full matrix.
+    # Parameters (and x) can also be draws x inputs matrices, e.g. the coefficients of the species of every observation
+    # the model is evaluated in dtype, so a block of float32 values takes half the memory and can hold twice the inputs
+    params = {col: np.atleast_1d(np.asarray(draws[col], dtype = dtype)) for col in cols}
+    params = {col: values if values.ndim == 2 else values[:, None] for col, values in params.items()}
+    x = np.asarray(x, dtype = dtype)
+    num_draws = max(values.shape[0] for values in params.values())
+    num_inputs = x.shape[-1]
+
+    block_size = max(1, int(memory_budget_mb * 2**20 // (np.dtype(dtype).itemsize * num_draws)))
+    if reduce is None:
+        out = np.empty((num_draws, num_inputs), dtype = dtype)
+    elif reduce in ("mean", "std"):
+        out = np.empty(num_inputs, dtype = dtype)
+    elif reduce == "quantile":
+        out = np.empty((len(quantiles), num_inputs), dtype = dtype)
+    else:
+        raise ValueError(f"Unknown reduction {reduce}")
+
+    for start in range(0, num_inputs, block_size):
+        block = slice(start, min(start + block_size, num_inputs))
+        block_params = {col: values if values.shape[1] == 1 else values[:, block] for col, values in params.items()}
+        block_x = x[..., block] if x.ndim == 2 else x[None, block]
+        values = model_function(block_x, block_params)
+        if reduce is None:
+            out[:, block] = values
+        elif reduce == "mean":
+            out[block] = values.mean(axis = 0)
+        elif reduce == "std":
+            out[block] = values.std(axis = 0)
+        else:
+            out[:, block] = np.quantile(values, quantiles, axis = 0)
+    return out
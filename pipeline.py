@@ -0,0 +1,210 @@
+# Copyright 2022 Cristian Grosu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+from utils.lazy_import import handler_source, imported_sources, run_handler
+from utils.model_registry import compile_models, normalize_stan_code
+from utils.dataset import load_dataset
+from utils.simulation import spawn_seeds
+from utils.stan_models import get_stan_code, stan_question
+
+DATA_FILE = "data/merged_data.csv"
+STATE_FILE = os.path.join(".pipeline", "state.json")
+
+SIMPLE_COLS = ["d18_O_w", "d18_O", "temperature"]
+SPECIES_COLS = ["d18_O_w", "d18_O", "temperature", "species"]
+PREDICTION_COLS = ["d18_O_w", "d18_O", "temperature", "species", "d18_O_w_sd", "d18_O_sd"]
+
+def run_Q3_A_species(species, seed = 1):
+    from hierarchical_flow import fit_species_Q3_A
+    dataset = load_dataset(DATA_FILE, cols = SPECIES_COLS)
+    fit_species_Q3_A(species, dataset.frame(species = species), seed = seed)
+
+def get_stages(data_df, engine = "monte_carlo", parameterization = "centered"):
+    # every stage declares what it reads (data columns and rows, stan program, seed, upstream stages) and where it writes;
+    # handlers are "module:function" names, a module and its dependencies are only imported when one of its stages runs
+    # the centered parameterization is the default of the flows, so it adds no keyword and keeps the stage hashes
+    variant = {} if parameterization == "centered" else {"parameterization": parameterization}
+    stages = {
+        "Q1": {"function": "simple_flow:simple_flow_Q1", "cols": SIMPLE_COLS, "stan": "Q1", "seed": 1, "upstream": [], "outputs": [os.path.join("results", "Q1"), os.path.join("plots", "Q1")]},
+        "Q2": {"function": "simple_flow:simple_flow_Q2", "cols": SIMPLE_COLS, "stan": "Q2", "seed": 1, "upstream": [], "outputs": [os.path.join("results", "Q2"), os.path.join("plots", "Q2")]},
+        "Q3_B": {"function": "hierarchical_flow:hierarchical_flow_Q3_B", "kwargs": variant, "cols": SPECIES_COLS, "stan": stan_question("Q3_B", parameterization), "seed": 1, "upstream": [], "outputs": [os.path.join("results", "Q3_B"), os.path.join("plots", "Q3_B")]},
+    }
+
+    # cross validation of the no pooling against the partial pooling model
+    stages["Q3_compare"] = {"function": "hierarchical_flow:hierarchical_flow_Q3_compare", "cols": SPECIES_COLS, "stan": ["Q3_A_cv", "Q3_B_cv"], "seed": 1, "upstream": [], "outputs": [os.path.join("results", "Q3_compare")]}
+
+    # the no pooling model is fitted per species, editing the rows of one species only reruns its stage;
+    # the species seeds are spawned as in hierarchical_flow_Q3_A and are part of the stage hash
+    species_order = data_df["species"].cat.categories
+    for species, seed in zip(species_order, spawn_seeds(1, len(species_order))):
+        stages[f"Q3_A/{species}"] = {
+            "function": "pipeline:run_Q3_A_species", "args": (species, seed), "cols": SPECIES_COLS, "rows": data_df["species"] == species, "stan": "Q3_A", "seed": seed, "upstream": [],
+            "outputs": [os.path.join("results", "Q3_A", "species_" + species), os.path.join("plots", "Q3_A", species)],
+        }
+
+    # the posterior engine reads the Q3_B draws, Q4_B always compares against the Q4_A predictions
+    q4_upstream = ["Q3_B"] if engine == "posterior" else []
+    stages["Q4_A"] = {"function": "hierarchical_flow:hierarchical_flow_Q4_A", "kwargs": dict({"engine": engine}, **(variant if engine == "stan" else {})), "cols": PREDICTION_COLS, "stan": stan_question("Q4_A", parameterization) if engine == "stan" else None, "seed": 1, "upstream": q4_upstream, "outputs": [os.path.join("results", "Q4_A"), os.path.join("plots", "Q4_A")]}
+    stages["Q4_B"] = {"function": "hierarchical_flow:hierarchical_flow_Q4_B", "kwargs": dict({"engine": engine}, **(variant if engine == "stan" else {})), "cols": PREDICTION_COLS, "stan": stan_question("Q4_B", parameterization) if engine == "stan" else None, "seed": 1, "upstream": q4_upstream + ["Q4_A"], "outputs": [os.path.join("results", "Q4_B"), os.path.join("plots", "Q4_B")]}
+    return stages
+
+def select_stages(stages, targets = None):
+    # a target is a stage name or a question, "Q3_A" selects the stages of all its species
+    if not targets:
+        selected = list(stages)
+    else:
+        selected = []
+        for target in targets:
+            matches = [name for name in stages if name == target or name.startswith(target + "/")]
+            if not matches:
+                raise ValueError(f"Question {target} not implemented")
+            selected += matches
+
+    # pull in everything the selected stages depend on
+    needed = set()
+    pending = list(selected)
+    while pending:
+        name = pending.pop()
+        if name not in needed:
+            needed.add(name)
+            pending += stages[name]["upstream"]
+    return [name for name in stages if name in needed]
+
+def run_pipeline(targets = None, jobs = 1, force = False, engine = "monte_carlo", parameterization = "centered"):
+    data_df = load_dataset(DATA_FILE).frame()
+    stages = get_stages(data_df, engine = engine, parameterization = parameterization)
+    selected = select_stages(stages, targets)
+    state = read_state()
+
+    done, failed = set(), set()
+    remaining = list(selected)
+    while remaining:
+        # stages whose upstream stages are finished can run concurrently
+        ready = [name for name in remaining if all(upstream in done or upstream in failed for upstream in stages[name]["upstream"])]
+        remaining = [name for name in remaining if name not in ready]
+
+        to_run = {}
+        for name in ready:
+            if any(upstream in failed for upstream in stages[name]["upstream"]):
+                print(f"Skipping {name}, an upstream stage failed")
+                failed.add(name)
+                continue
+            input_hash = stage_input_hash(name, stages[name], data_df, state)
+            if not force and is_up_to_date(stages[name], state.get(name), input_hash):
+                print(f"{name} is up to date")
+                done.add(name)
+            else:
+                to_run[name] = input_hash
+
+        for name, error in run_stages(stages, list(to_run), jobs).items():
+            if error is None:
+                state[name] = {"input_hash": to_run[name], "output_hash": outputs_hash(stages[name]["outputs"])}
+                done.add(name)
+            else:
+                print(f"Stage {name} failed: {error!r}")
+                failed.add(name)
+        write_state(state)
+
+    return done, failed
+
+def run_stages(stages, names, jobs):
+    errors = {}
+    if jobs == 1 or len(names) <= 1:
+        for name in names:
+            print(f"Running {name}")
+            try:
+                run_stage(stages[name])
+                errors[name] = None
+            except Exception as e:
+                errors[name] = e
+        return errors
+
+    # the programs of the stages are compiled here, concurrent stages would otherwise compile the same program at once
+    compile_models([program for name in names for program in _stage_programs(stages[name])])
+    with ProcessPoolExecutor(max_workers = jobs) as executor:
+        futures = {name: executor.submit(run_stage, stages[name]) for name in names}
+        for name, future in futures.items():
+            try:
+                future.result()
+                errors[name] = None
+            except Exception as e:
+                errors[name] = e
+    return errors
+
+def run_stage(stage):
+    return run_handler(stage["function"], *stage.get("args", ()), **stage.get("kwargs", {}))
+
+def stage_input_hash(name, stage, data_df, state):
+    digest = hashlib.sha256(name.encode("utf-8"))
+
+    # the handler source is read from its file, hashing a stage does not import the flows; the project modules
+    # its module imports are hashed whole, an edit of a helper in utils reruns the stages that may call it
+    digest.update(repr(stage.get("args", ())).encode("utf-8"))
+    digest.update(repr(sorted(stage.get("kwargs", {}).items())).encode("utf-8"))
+    digest.update(handler_source(stage["function"]).encode("utf-8"))
+    for module_name, source in imported_sources(stage["function"]).items():
+        digest.update(module_name.encode("utf-8"))
+        digest.update(source.encode("utf-8"))
+
+    rows = data_df if stage.get("rows") is None else data_df[stage["rows"]]
+    digest.update(pd.util.hash_pandas_object(rows[stage["cols"]], index = False).values.tobytes())
+
+    for program in _stage_programs(stage):
+        digest.update(normalize_stan_code(get_stan_code(question = program)).encode("utf-8"))
+    digest.update(repr(stage["seed"]).encode("utf-8"))
+
+    for upstream in stage["upstream"]:
+        digest.update(state.get(upstream, {}).get("output_hash", "").encode("utf-8"))
+    return digest.hexdigest()
+
+def _stage_programs(stage):
+    # a stage can sample several programs, or none
+    return [stage["stan"]] if isinstance(stage["stan"], str) else stage["stan"] or []
+
+def is_up_to_date(stage, stage_state, input_hash):
+    if stage_state is None or stage_state["input_hash"] != input_hash:
+        return False
+    # outputs removed or edited by hand since the last run
+    return stage_state["output_hash"] == outputs_hash(stage["outputs"])
+
+def outputs_hash(outputs):
+    digest = hashlib.sha256()
+    for output in outputs:
+        for root, dirs, files in sorted(os.walk(output)):
+            dirs.sort()
+            for file_name in sorted(files):
+                path = os.path.join(root, file_name)
+                digest.update(path.encode("utf-8"))
+                with open(path, "rb") as f:
+                    for block in iter(lambda: f.read(2**20), b""):
+                        digest.update(block)
+    return digest.hexdigest()
+
+def read_state():
+    if not os.path.exists(STATE_FILE):
+        return {}
+    with open(STATE_FILE, "r") as f:
+        return json.load(f)
+
+def write_state(state):
+    os.makedirs(os.path.dirname(STATE_FILE), exist_ok = True)
+    with open(STATE_FILE, "w") as f:
+        json.dump(state, f, indent = 2)
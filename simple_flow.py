@@ -12,85 +12,96 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from matplotlib import pyplot as plt
-from utils.plotter import plot_data, plot_data_and_fit
-from utils.read import read_data
+from utils.plotter import plot_data, plot_data_and_fit, plot_prior_predictive_check
+from utils.rendering import PlotQueue
+from utils.dataset import load_dataset
 import numpy as np
-import stan
-from utils.stan_models import get_stan_code
-from utils.write import write_results
-import arviz as av
+from utils.model_registry import get_model
+from utils.sufficient_stats import compute_sufficient_statistics, get_collapsed_data
+from utils.conjugate import ConjugatePosterior
+from utils.sampling import sample_until_converged
+from utils.diagnostics import summarize_frame
+from utils.write import write_draws, write_summary
+from utils.prior_predictive import get_priors, prior_predictive
 from model_function import construct_model_function
 
-def simple_flow_Q1():
+def simple_flow_Q1(engine = "stan"):
     question = "Q1"
-    stan_code = get_stan_code(question=question)
-    data = read_data("data/merged_data.csv", cols = ["d18_O_w", "d18_O", "temperature"])
+    dataset = load_dataset("data/merged_data.csv", cols = ["d18_O_w", "d18_O", "temperature"])
     data = {
-        "N": len(data),
-        "d18_O_w": data["d18_O_w"].to_list(),
-        "d18_O_c": data["d18_O"].to_list(),
-        "y": data["temperature"].to_list()
+        "N": dataset.num_rows,
+        "d18_O_w": dataset["d18_O_w"].tolist(),
+        "d18_O_c": dataset["d18_O"].tolist(),
+        "y": dataset["temperature"].tolist()
     }
     
     # visualizing the data 
     x = np.array(data["d18_O_c"]) - np.array(data["d18_O_w"])
     y = data["y"]
     
-    # plotting the data
-    plot_data(x, y, folder = question)
+    # the plots are rendered by worker processes while the model is sampled
+    with PlotQueue() as plots:
+        # plotting the data
+        plots.submit(plot_data, x, y, folder = question)
     
-    # fitting the model
-    posterior = stan.build(stan_code, data=data, random_seed=1)
+        # fitting the model, the collapsed model only sees the sufficient statistics of the data,
+        # the conjugate engine draws from the exact posterior of the flat priors without Stan
+        if engine == "collapsed":
+            stats = compute_sufficient_statistics("data/merged_data.csv").sum()
+            posterior = get_model(question = "Q1_collapsed").build(get_collapsed_data(stats), random_seed=1)
+        elif engine == "conjugate":
+            posterior = ConjugatePosterior(compute_sufficient_statistics("data/merged_data.csv").sum(), random_seed=1)
+        else:
+            posterior = get_model(question = question).build(data, random_seed=1)
     
-    fit = posterior.sample(num_chains=4, num_samples=1000)
-    df = fit.to_frame()
-    print(av.summary(fit))
-    print(df.describe().T)    
+        # sampling stops once every parameter converged with enough effective draws
+        fit = sample_until_converged(posterior, num_chains=4, increment=250)
+        df = fit.to_frame()
+        print(fit.summary)
            
-    # getting the parameters from the posterior   
-    write_results(df, file_name = "results.txt", cols = ["a", "b", "sigma"], folder=question)
+        # getting the parameters from the posterior, results.txt comes from the summary printed above
+        write_draws(df, cols = [col for col in df.columns if not col.endswith("__")], folder = question, num_chains = fit.num_chains)
+        write_summary(fit.summary, file_name = "results.txt", cols = ["a", "b", "sigma"], folder=question)
     
-    plot_data_and_fit(x, y, df, construct_model_function(), folder = question)
+        plots.submit(plot_data_and_fit, x, y, df, construct_model_function(), folder = question)
 
 
-def simple_flow_Q2():
+def simple_flow_Q2(prior_only = False):
     question = "Q2"
-    stan_code = get_stan_code(question=question)
-    data = read_data("data/merged_data.csv", cols = ["d18_O_w", "d18_O", "temperature"])
+    dataset = load_dataset("data/merged_data.csv", cols = ["d18_O_w", "d18_O", "temperature"])
     data = {
-        "N": len(data),
-        "d18_O_w": data["d18_O_w"].to_list(),
-        "d18_O_c": data["d18_O"].to_list(),
-        "y": data["temperature"].to_list()
+        "N": dataset.num_rows,
+        "d18_O_w": dataset["d18_O_w"].tolist(),
+        "d18_O_c": dataset["d18_O"].tolist(),
+        "y": dataset["temperature"].tolist()
     }
     
     # visualizing the data 
     x = np.array(data["d18_O_c"]) - np.array(data["d18_O_w"])
     y = data["y"]
     
-    # plotting the data
-    plot_data(x, y, folder = question)
+    # the plots are rendered by worker processes while the model is sampled
+    with PlotQueue() as plots:
+        # plotting the data
+        plots.submit(plot_data, x, y, folder = question)
     
-    # fitting the model
-    posterior = stan.build(stan_code, data=data, random_seed=1)
+        # prior predictive check, the priors of the program are sampled directly without compiling it
+        prior_df = prior_predictive(get_priors(question = question), num_draws = 4000, rng = 1)
+        plots.submit(plot_prior_predictive_check, prior_df["delta"], prior_df["y_new"], folder = question)
+        if prior_only:
+            return
     
-    fit = posterior.sample(num_chains=4, num_samples=1000)
-    df = fit.to_frame()
-    print(av.summary(fit))
-    print(df.describe().T)    
-
-    # prior predictive check
-    x = df["delta"]
-    y = df["y_new"]
-    plt.scatter(x,y, alpha = 0.3)
-    plt.plot(np.linspace(-4,5,100), [-2] * 100, color = "red", label = "Temperature = -2 C")
-    plt.plot(np.linspace(-4,5,100), [50] * 100, color = "orange", label = "Temperature = 50 C")
-    plt.legend()
-    plt.show()
-    plt.savefig("./plots/Q2/prior_predictive_check.png")
+        # fitting the model
+        posterior = get_model(question = question).build(data, random_seed=1)
+    
+        fit = posterior.sample(num_chains=4, num_samples=1000)
+        df = fit.to_frame()
+        # one summary for every parameter
+        summary = summarize_frame(df, fit.num_chains)
+        print(summary)
                
-    # getting the parameters from the posterior   
-    write_results(df, file_name = "results.txt", cols = ["a", "b", "sigma"], folder=question)
+        # getting the parameters from the posterior, results.txt comes from the summary printed above
+        write_draws(df, cols = [col for col in df.columns if not col.endswith("__")], folder = question, num_chains = fit.num_chains)
+        write_summary(summary, file_name = "results.txt", cols = ["a", "b", "sigma"], folder=question)
     
-    plot_data_and_fit(x, y, df, construct_model_function(), folder = question)
\ No newline at end of file
+        plots.submit(plot_data_and_fit, x, y, df, construct_model_function(), folder = question)
@@ -0,0 +1,47 @@
+# Copyright 2022 Cristian Grosu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import tracemalloc
+
+import pandas as pd
+
+import hierarchical_flow
+from benchmark import StageTimer, timed_calls
+from utils import write
+from utils.model_registry import CompiledModel
+
+def test_timed_calls_time_the_functions_imported_by_name_and_restore_them(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    original_write, original_build = write.write_results, CompiledModel.build
+    timer = StageTimer()
+    substages = {"write_results": ["utils.write:write_results"], "stan_build": ["utils.model_registry:CompiledModel.build"]}
+
+    tracemalloc.start()
+    try:
+        with timed_calls(timer, substages), timer.total():
+            assert hierarchical_flow.write_results is not original_write
+            assert CompiledModel.build is not original_build
+            hierarchical_flow.write_results(pd.DataFrame({"a": [1.0, 2.0]}), cols = ["a"], folder = "Q1")
+            # nested calls count once, towards the outer sub-stage
+            with timer.stage("write_results"):
+                write.write_results(pd.DataFrame({"a": [1.0, 2.0]}), cols = ["a"], folder = "Q1")
+    finally:
+        tracemalloc.stop()
+
+    assert hierarchical_flow.write_results is original_write and write.write_results is original_write
+    assert CompiledModel.build is original_build
+    results = timer.results()
+    assert results["stages"]["write_results"]["calls"] == 2
+    assert "stan_build" not in results["stages"]
+    assert results["stages"]["other"]["seconds"] >= 0
@@ -0,0 +1,50 @@
+# Copyright 2022 Cristian Grosu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pandas as pd
+
+from utils.conjugate import conjugate_posterior, sample_conjugate_posterior
+from utils.sufficient_stats import sufficient_statistics
+
+def make_data(num_rows = 200, seed = 0):
+    rng = np.random.default_rng(seed)
+    d18_O_w = rng.normal(0, 1, num_rows)
+    d18_O = d18_O_w + rng.normal(1, 1, num_rows)
+    temperature = 18 - 4.5 * (d18_O - d18_O_w) + rng.normal(0, 2, num_rows)
+    return pd.DataFrame({"species": "S", "temperature": temperature, "d18_O_w": d18_O_w, "d18_O": d18_O})
+
+def test_posterior_mean_is_least_squares_fit():
+    data_df = make_data()
+    x = data_df["d18_O"] - data_df["d18_O_w"]
+    ols = np.polyfit(x, data_df["temperature"], 1)[::-1]
+    posterior = conjugate_posterior(sufficient_statistics(data_df).iloc[0])
+    np.testing.assert_allclose(posterior["mean"], ols, rtol = 1e-10)
+
+def test_sampled_moments_match_least_squares_fit():
+    data_df = make_data()
+    x = np.asarray(data_df["d18_O"] - data_df["d18_O_w"])
+    y = np.asarray(data_df["temperature"])
+    design = np.column_stack((np.ones(len(x)), x))
+    ols, rss = np.linalg.lstsq(design, y, rcond = None)[:2]
+    # with the flat priors (shape n / 2 - 3 / 2, rate rss / 2) the coefficients are Student t with n - 3 degrees of freedom
+    # around the OLS fit, scale rss / (n - 3) (X^T X)^-1 and so covariance rss / (n - 5) (X^T X)^-1
+    n = len(x)
+    covariance = rss[0] / (n - 5) * np.linalg.inv(design.T @ design)
+
+    df = sample_conjugate_posterior(conjugate_posterior(sufficient_statistics(data_df).iloc[0]), num_samples = 20000, num_chains = 4, rng = np.random.default_rng(1))
+    draws = df[["a", "b"]].to_numpy()
+    standard_errors = np.sqrt(np.diag(covariance) / len(draws))
+    assert np.all(np.abs(draws.mean(axis = 0) - ols) < 5 * standard_errors)
+    np.testing.assert_allclose(np.cov(draws.T), covariance, rtol = 0.05)
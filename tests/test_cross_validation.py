@@ -0,0 +1,34 @@
+# Copyright 2022 Cristian Grosu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+
+from utils.cross_validation import compare_by_species
+
+def test_method_counts_the_refitted_rows_of_every_species():
+    species = np.array(["S1", "S1", "S2", "S2", "S2", "S3"])
+    pointwise = {"no_pooling": np.full(6, -1.0), "partial_pooling": np.full(6, -0.5)}
+    pareto_k = {"no_pooling": np.array([0.1, 0.9, 0.2, 0.8, 0.1, 0.3]), "partial_pooling": np.array([0.1, 0.2, 0.2, 0.3, 0.9, 0.3])}
+    refitted = {model: k > 0.7 for model, k in pareto_k.items()}
+
+    df = compare_by_species(pointwise, pareto_k, species, refitted = refitted)
+    assert list(df["method"]) == ["psis-loo+kfold(n_refit=1)", "psis-loo+kfold(n_refit=2)", "psis-loo", "psis-loo+kfold(n_refit=3)"]
+    assert list(df.index) == ["S1", "S2", "S3", "all"]
+    np.testing.assert_allclose(df["elpd_diff_partial_pooling"], [1.0, 1.5, 0.5, 3.0])
+
+def test_method_is_psis_loo_without_refits():
+    species = np.array(["S1", "S2"])
+    pointwise = {"no_pooling": np.zeros(2), "partial_pooling": np.zeros(2)}
+    df = compare_by_species(pointwise, {model: np.zeros(2) for model in pointwise}, species)
+    assert (df["method"] == "psis-loo").all()
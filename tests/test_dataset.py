@@ -0,0 +1,86 @@
+# Copyright 2022 Cristian Grosu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from utils import dataset
+from utils.dataset import load_dataset
+
+def write_csv(path, temperature):
+    df = pd.DataFrame({
+        "species": ["S1", "S2", "S1", "S3", "S2"],
+        "temperature": temperature,
+        "d18_O_w": [0.1, 0.2, 0.3, 0.4, 0.5],
+        "d18_O": [1.1, 1.2, 1.3, 1.4, 1.5],
+    })
+    df.to_csv(path, index = False)
+    return df
+
+def count_builds(monkeypatch):
+    builds = []
+    build_cache = dataset._build_cache
+    def counted(filename, cache):
+        builds.append(filename)
+        return build_cache(filename, cache)
+    monkeypatch.setattr(dataset, "_build_cache", counted)
+    return builds
+
+def test_cache_is_built_once_and_reused(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    builds = count_builds(monkeypatch)
+    df = write_csv("data.csv", [10.0, 11.0, 12.0, 13.0, 14.0])
+
+    first = load_dataset("data.csv")
+    assert len(builds) == 1
+    second = load_dataset("data.csv", cols = ["temperature"])
+    assert len(builds) == 1
+
+    np.testing.assert_array_equal(second["temperature"], df["temperature"])
+    assert list(first.species) == ["S1", "S2", "S3"]
+    np.testing.assert_array_equal(first.group, [1, 2, 1, 3, 2])
+    np.testing.assert_array_equal(first.species_rows("S2"), [1, 4])
+    pd.testing.assert_frame_equal(first.frame("S1")[["temperature", "d18_O"]], df.iloc[[0, 2]][["temperature", "d18_O"]].reset_index(drop = True))
+
+def test_touched_csv_keeps_the_cache(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    builds = count_builds(monkeypatch)
+    write_csv("data.csv", [10.0, 11.0, 12.0, 13.0, 14.0])
+    load_dataset("data.csv")
+
+    stat = os.stat("data.csv")
+    os.utime("data.csv", ns = (stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    load_dataset("data.csv")
+    assert len(builds) == 1
+
+def test_edited_csv_invalidates_the_cache(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    builds = count_builds(monkeypatch)
+    write_csv("data.csv", [10.0, 11.0, 12.0, 13.0, 14.0])
+    old = load_dataset("data.csv")
+    old_temperature = np.array(old["temperature"])
+
+    # same size, so only the content hash tells the edit apart
+    stat = os.stat("data.csv")
+    df = write_csv("data.csv", [20.0, 21.0, 22.0, 23.0, 24.0])
+    os.utime("data.csv", ns = (stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert os.stat("data.csv").st_size == stat.st_size
+
+    new = load_dataset("data.csv")
+    assert len(builds) == 2
+    np.testing.assert_array_equal(new["temperature"], df["temperature"])
+    # the memory maps of the dataset loaded before the rebuild still read the old columns
+    np.testing.assert_array_equal(old["temperature"], old_temperature)
@@ -0,0 +1,48 @@
+# Copyright 2022 Cristian Grosu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+
+from utils.diagnostics import summarize
+
+def make_draws(seed = 0):
+    # chains x draws x parameters: independent draws, an AR(1) chain and chains that disagree on their location
+    rng = np.random.default_rng(seed)
+    num_chains, num_draws = 4, 1000
+    independent = rng.normal(size = (num_chains, num_draws))
+    autocorrelated = np.empty((num_chains, num_draws))
+    autocorrelated[:, 0] = rng.normal(size = num_chains)
+    for i in range(1, num_draws):
+        autocorrelated[:, i] = 0.9 * autocorrelated[:, i - 1] + rng.normal(size = num_chains)
+    shifted = rng.normal(size = (num_chains, num_draws)) + np.arange(num_chains)[:, None] * 0.5
+    return np.stack((independent, autocorrelated, shifted), axis = -1)
+
+def test_rhat_and_ess_match_arviz():
+    # arviz is not a dependency of the flows, it only serves as the reference implementation
+    az = pytest.importorskip("arviz")
+    draws = make_draws()
+    summary = summarize(draws, names = ["independent", "autocorrelated", "shifted"])
+    for j, name in enumerate(summary.index):
+        np.testing.assert_allclose(summary.loc[name, "r_hat"], az.rhat(draws[:, :, j], method = "rank"), rtol = 1e-6)
+        np.testing.assert_allclose(summary.loc[name, "ess_bulk"], az.ess(draws[:, :, j], method = "bulk"), rtol = 1e-6)
+        np.testing.assert_allclose(summary.loc[name, "ess_tail"], az.ess(draws[:, :, j], method = "tail"), rtol = 1e-6)
+
+def test_known_diagnostics():
+    summary = summarize(make_draws(), names = ["independent", "autocorrelated", "shifted"])
+    assert summary.loc["independent", "r_hat"] < 1.01
+    assert summary.loc["independent", "ess_bulk"] > 3000
+    # an AR(1) chain with coefficient 0.9 has about (1 - 0.9) / (1 + 0.9) of its draws worth of information
+    assert 100 < summary.loc["autocorrelated", "ess_bulk"] < 400
+    assert summary.loc["shifted", "r_hat"] > 1.1
@@ -0,0 +1,50 @@
+# Copyright 2022 Cristian Grosu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+import numpy as np
+
+from utils.conjugate import SampledFit
+from utils.extract import draws_frame, extract_draws
+
+class FakeStanFit:
+    # the attributes of a PyStan fit that the extractor reads, the sampler output is (columns, draws, chains)
+    def __init__(self, num_new, num_draws = 20, num_chains = 2, seed = 0):
+        self.sample_and_sampler_param_names = ["lp__", "stepsize__"]
+        self.constrained_param_names = ["a", "sigma"] + [f"y_new.{k + 1}" for k in range(num_new)]
+        self.num_chains = num_chains
+        self._draws = np.random.default_rng(seed).normal(size = (2 + len(self.constrained_param_names), num_draws, num_chains))
+
+def test_selected_draws_are_the_sampler_columns():
+    fit = FakeStanFit(5)
+    draws = extract_draws(fit, include = ["y_new", "sigma"], thin = 2)
+    assert list(draws) == ["sigma"] + [f"y_new.{k + 1}" for k in range(5)]
+    np.testing.assert_array_equal(draws["y_new.3"], fit._draws[2 + 2 + 2].T[:, ::2])
+    assert extract_draws(fit, include = ["a"], dtype = np.float32)["a"].dtype == np.float32
+
+def test_stan_and_frame_fits_give_the_same_frame():
+    fit = FakeStanFit(3)
+    df = draws_frame(fit, exclude = ["lp__", "stepsize__"])
+    # to_frame() interleaves the chains
+    sampled = SampledFit(df, fit.num_chains)
+    np.testing.assert_array_equal(draws_frame(sampled).to_numpy(), df.to_numpy())
+
+def test_many_generated_quantities_are_extracted_quickly():
+    fit = FakeStanFit(30000, num_draws = 10)
+    start = time.perf_counter()
+    draws = extract_draws(fit, include = ["y_new"])
+    # a lookup of every name in the list of names took tens of seconds here
+    assert time.perf_counter() - start < 5
+    assert len(draws) == 30000
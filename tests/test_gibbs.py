@@ -0,0 +1,94 @@
+# Copyright 2022 Cristian Grosu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pandas as pd
+
+from utils.gibbs import GibbsPosterior, SIGMA_A_PRIOR, _metropolis_scale
+from utils.sampling import _last_draws
+from utils.sufficient_stats import sufficient_statistics
+
+PARAMETERS = ["A", "B", "sigma", "sigma_a", "sigma_b"]
+
+# posterior means and sds of Q3_B_collapsed on data/merged_data.csv, 4 chains of 5000 draws of Stan with random_seed=1
+STAN_REFERENCE = pd.DataFrame({
+    "A": [15.464150, 0.766438],
+    "B": [-3.626348, 0.247130],
+    "sigma": [0.838592, 0.031960],
+    "sigma_a": [2.411471, 0.451787],
+    "sigma_b": [0.651498, 0.204415],
+}, index = ["mean", "std"])
+
+def merged_statistics():
+    return sufficient_statistics(pd.read_csv("data/merged_data.csv"))
+
+def test_metropolis_step_keeps_the_scale_posterior():
+    # many independent chains of the group scale given fixed deviations, started from the prior, must end up
+    # distributed as the exact one dimensional posterior computed on a grid
+    rng = np.random.default_rng(0)
+    num_chains = 4000
+    deviations = np.tile(rng.normal(0, 2, size = (1, 12)), (num_chains, 1))
+    scale = np.abs(rng.normal(*SIGMA_A_PRIOR, size = (num_chains, 1)))
+    step = np.full((num_chains, 1), 0.5)
+    accepted = 0
+    for _ in range(200):
+        scale, accepted_now = _metropolis_scale(scale, deviations, SIGMA_A_PRIOR, step, rng)
+        accepted += accepted_now.mean() / 200
+    assert np.all(scale > 0)
+    assert 0.2 < accepted < 0.9
+
+    # scale | deviations ~ scale^-J exp(-sum(deviations^2) / (2 scale^2)) half_normal(scale | prior), on an even grid of the scale
+    grid = np.linspace(1e-3, 20, 20001)
+    log_weights = -deviations.shape[1] * np.log(grid) - (deviations[0] ** 2).sum() / (2 * grid ** 2) - (grid - SIGMA_A_PRIOR[0]) ** 2 / (2 * SIGMA_A_PRIOR[1] ** 2)
+    weights = np.exp(log_weights - log_weights.max())
+    weights /= weights.sum()
+    mean = (weights * grid).sum()
+    std = np.sqrt((weights * grid ** 2).sum() - mean ** 2)
+    np.testing.assert_allclose(scale.mean(), mean, atol = 4 * std / np.sqrt(num_chains))
+    np.testing.assert_allclose(scale.std(), std, rtol = 0.1)
+
+def test_metropolis_step_is_reproducible_with_a_seed():
+    deviations = np.random.default_rng(0).normal(0, 1, size = (4, 10))
+    scale = np.ones((4, 1))
+    step = np.full((4, 1), 0.5)
+    first = _metropolis_scale(scale, deviations, SIGMA_A_PRIOR, step, np.random.default_rng(7))
+    second = _metropolis_scale(scale, deviations, SIGMA_A_PRIOR, step, np.random.default_rng(7))
+    np.testing.assert_array_equal(first[0], second[0])
+    np.testing.assert_array_equal(first[1], second[1])
+
+def test_continuation_starts_from_the_init_and_keeps_the_steps():
+    posterior = GibbsPosterior(merged_statistics(), random_seed = 1, num_warmup = 200)
+    df = posterior.sample(num_chains = 2, num_samples = 50).to_frame()
+    steps = posterior.steps.copy()
+    assert not np.allclose(steps, 0.5)
+
+    # no warmup, so the tuned steps are left as they are
+    block = df.to_numpy().reshape(50, 2, len(df.columns)).transpose(1, 0, 2)
+    init = _last_draws(block, list(df.columns))
+    assert [chain["A"] for chain in init] == list(df["A"].iloc[-2:])
+    posterior.sample(num_chains = 2, num_samples = 10, init = init, num_warmup = 0)
+    np.testing.assert_array_equal(posterior.steps, steps)
+
+    # an init far out in the tail with tiny group scales pins the first coefficients to it, a fresh start does not
+    far = [dict(chain, A = 40.0, sigma_a = 1e-3) for chain in init]
+    first = posterior.sample(num_chains = 2, num_samples = 1, init = far, num_warmup = 0).to_frame()
+    a = first[[col for col in first.columns if col.startswith("a.")]]
+    np.testing.assert_allclose(a.mean(axis = 1), 40.0, atol = 0.1)
+
+def test_posterior_matches_the_collapsed_stan_fit():
+    df = GibbsPosterior(merged_statistics(), random_seed = 3).sample(num_chains = 4, num_samples = 2000).to_frame()
+    summary = df[PARAMETERS].agg(["mean", "std"])
+    # a few Monte Carlo standard errors of the means, the sds agree to within 10%
+    assert np.all(np.abs(summary.loc["mean"] - STAN_REFERENCE.loc["mean"]) < 0.15 * STAN_REFERENCE.loc["std"])
+    np.testing.assert_allclose(summary.loc["std"], STAN_REFERENCE.loc["std"], rtol = 0.1)
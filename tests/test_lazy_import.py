@@ -0,0 +1,40 @@
+# Copyright 2022 Cristian Grosu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def loaded_after_resolving(spec):
+    # a fresh interpreter, the modules this test process already imported would hide what resolving loads
+    code = (
+        "import sys\n"
+        "from utils.lazy_import import resolve_handler\n"
+        f"resolve_handler({spec!r})\n"
+        "print(' '.join(sorted({name.split('.')[0] for name in sys.modules})))\n"
+    )
+    result = subprocess.run([sys.executable, "-c", code], cwd = ROOT, capture_output = True, text = True, check = True)
+    return set(result.stdout.split())
+
+@pytest.mark.parametrize("spec", ["hierarchical_flow:hierarchical_flow_Q4_A", "hierarchical_flow:hierarchical_flow_Q4_B"])
+def test_prediction_handlers_resolve_without_the_heavy_imports(spec):
+    loaded = loaded_after_resolving(spec)
+    assert "scipy" not in loaded
+    assert "matplotlib" not in loaded
+    assert "stan" not in loaded
+    assert "arviz" not in loaded
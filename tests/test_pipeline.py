@@ -0,0 +1,64 @@
+# Copyright 2022 Cristian Grosu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pandas as pd
+
+import pipeline
+from utils import model_registry
+
+class FakeModel:
+    def __init__(self, compiled):
+        self.model_name = "models/fake" if compiled else None
+        self.compiled = 0
+
+    def compile(self):
+        self.compiled += 1
+        self.model_name = "models/fake"
+        return self
+
+def test_programs_are_compiled_once_before_concurrent_stages(monkeypatch):
+    requested = []
+    monkeypatch.setattr(pipeline, "compile_models", lambda questions: requested.extend(questions))
+    stages = {
+        "Q3_A/first": {"function": "os.path:join", "args": ("a", "b"), "stan": "Q3_A"},
+        "Q3_A/second": {"function": "os.path:join", "args": ("a", "c"), "stan": "Q3_A"},
+        "Q3_compare": {"function": "os.path:join", "args": ("d",), "stan": ["Q3_A_cv", "Q3_B_cv"]},
+        "Q4_A": {"function": "os.path:join", "args": ("e",), "stan": None},
+    }
+    errors = pipeline.run_stages(stages, list(stages), jobs = 2)
+    assert all(error is None for error in errors.values())
+    assert requested == ["Q3_A", "Q3_A", "Q3_A_cv", "Q3_B_cv"]
+
+def test_compile_models_compiles_every_missing_program_once(monkeypatch):
+    models = {"Q3_A": FakeModel(compiled = False), "Q3_A_cv": FakeModel(compiled = True)}
+    monkeypatch.setattr(model_registry, "get_model", lambda question: models[question])
+    model_registry.compile_models(["Q3_A", "Q3_A_cv", "Q3_A"])
+    assert models["Q3_A"].compiled == 1
+    assert models["Q3_A_cv"].compiled == 0
+
+def write_project(folder, helper_body):
+    # a handler module whose function body does not change, it calls a helper of another module of the project
+    (folder / "stage_flows.py").write_text("import os\n\ndef handler():\n    from stage_helpers import helper\n    return helper()\n")
+    (folder / "stage_helpers.py").write_text("import numpy as np\n\ndef helper():\n    return " + helper_body + "\n")
+
+def test_stage_hash_follows_the_source_of_imported_modules(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    data_df = pd.DataFrame({"x": [1.0, 2.0]})
+    stage = {"function": "stage_flows:handler", "cols": ["x"], "stan": None, "seed": 1, "upstream": []}
+
+    write_project(tmp_path, "1")
+    first = pipeline.stage_input_hash("stage", stage, data_df, {})
+    assert pipeline.stage_input_hash("stage", stage, data_df, {}) == first
+    write_project(tmp_path, "np.float64(2)")
+    assert pipeline.stage_input_hash("stage", stage, data_df, {}) != first
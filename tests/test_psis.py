@@ -0,0 +1,48 @@
+# Copyright 2022 Cristian Grosu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+
+from utils.psis import K_THRESHOLD, elpd_kfold, psis_loo
+
+def make_log_lik(num_draws = 2000, num_obs = 40, seed = 0):
+    # draws x observations normal log likelihood of a posterior of the mean, with two outlying observations
+    rng = np.random.default_rng(seed)
+    y = rng.normal(0, 1, num_obs)
+    y[:2] = [6.0, -7.0]
+    mu = rng.normal(y.mean(), 1 / np.sqrt(num_obs), num_draws)
+    return -0.5 * np.log(2 * np.pi) - 0.5 * (y[None, :] - mu[:, None]) ** 2
+
+def test_psis_loo_matches_arviz():
+    # arviz is not a dependency of the flows, it only serves as the reference implementation
+    az = pytest.importorskip("arviz")
+    log_lik = make_log_lik()
+    elpd, k = psis_loo(log_lik, block_size = 16)
+    # psis_loo does not correct for the relative efficiency of the draws, the reference gets the same r_eff = 1
+    reference = az.loo(az.from_dict(log_likelihood = {"y": log_lik[None]}), pointwise = True, reff = 1.0)
+    np.testing.assert_allclose(elpd, reference.loo_i.values, rtol = 1e-8)
+    np.testing.assert_allclose(k, reference.pareto_k.values, rtol = 1e-8)
+
+def test_outliers_get_the_highest_pareto_k():
+    elpd, k = psis_loo(make_log_lik())
+    assert set(np.argsort(k)[-2:]) == {0, 1}
+    assert (k[2:] < K_THRESHOLD).all()
+
+def test_elpd_kfold_covers_every_fold():
+    log_lik = make_log_lik(num_draws = 500, num_obs = 10)
+    holdout = [np.arange(10) % 2 == fold for fold in range(2)]
+    elpd = elpd_kfold([log_lik, log_lik], holdout)
+    expected = np.log(np.exp(log_lik).mean(axis = 0))
+    np.testing.assert_allclose(elpd, expected)
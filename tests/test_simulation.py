@@ -0,0 +1,47 @@
+# Copyright 2022 Cristian Grosu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pandas as pd
+
+from utils.predictive import simulate_predictive_with_measurement_error
+from utils.simulation import parallel_simulate, spawn_seeds
+
+def simulate(d18_O_c, d18_O_w, rng):
+    return simulate_predictive_with_measurement_error(d18_O_c, d18_O_w, 0.1, 0.2, 18.4, 1.4, -4.6, 0.5, 2.2, num_param_draws = 10, num_measurement_draws = 5, num_noise_draws = 5, rng = rng)
+
+def make_observations(num_obs = 37, seed = 0):
+    rng = np.random.default_rng(seed)
+    return {"d18_O_c": rng.normal(1, 1, num_obs), "d18_O_w": rng.normal(0, 1, num_obs)}
+
+def test_output_does_not_depend_on_the_number_of_workers():
+    observations = make_observations()
+    serial = parallel_simulate(simulate, observations, seed = 3, chunk_size = 8, workers = 1)
+    threads = parallel_simulate(simulate, observations, seed = 3, chunk_size = 8, workers = 3, use_threads = True)
+    processes = parallel_simulate(simulate, observations, seed = 3, chunk_size = 8, workers = 2)
+    pd.testing.assert_frame_equal(serial, threads)
+    pd.testing.assert_frame_equal(serial, processes)
+    assert list(serial.index) == [f"y_{i}" for i in range(37)]
+
+def test_output_depends_on_the_seed():
+    observations = make_observations()
+    first = parallel_simulate(simulate, observations, seed = 3, chunk_size = 8, workers = 1)
+    second = parallel_simulate(simulate, observations, seed = 4, chunk_size = 8, workers = 1)
+    assert not np.allclose(first["mean"], second["mean"])
+
+def test_spawned_seeds_are_distinct_and_reproducible():
+    seeds = spawn_seeds(1, 50)
+    assert seeds == spawn_seeds(1, 50)
+    assert len(set(seeds)) == 50
+    assert all(0 <= seed < 2**31 for seed in seeds)
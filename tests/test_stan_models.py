@@ -0,0 +1,31 @@
+# Copyright 2022 Cristian Grosu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from utils.stan_models import HIERARCHICAL_QUESTIONS, PARAMETERIZATIONS, get_stan_code, stan_question
+
+QUESTIONS = ["Q1", "Q2", "Q3_A", "Q3_B", "Q4_A", "Q4_B", "Q1_collapsed", "Q3_A_collapsed", "Q3_B_collapsed", "Q3_A_cv", "Q3_B_cv"]
+VARIANTS = QUESTIONS + [stan_question(question, parameterization) for question in HIERARCHICAL_QUESTIONS for parameterization in PARAMETERIZATIONS if parameterization != "centered"]
+
+@pytest.mark.parametrize("question", VARIANTS)
+def test_program_passes_stanc(question):
+    # stanc translates and type checks the program in a fraction of a second, the C++ build is left to the flows
+    compile = pytest.importorskip("httpstan.compile").compile
+    cpp_code, _ = compile(get_stan_code(question = question), "test_model")
+    assert "test_model" in cpp_code
+
+def test_parameterizations_of_non_hierarchical_questions_are_rejected():
+    with pytest.raises(ValueError):
+        stan_question("Q1", "non_centered")
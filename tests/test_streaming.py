@@ -0,0 +1,51 @@
+# Copyright 2022 Cristian Grosu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+
+from utils.streaming import QuantileSketch, RunningMoments
+
+def test_running_moments_of_blocks_match_numpy():
+    rng = np.random.default_rng(0)
+    values = rng.normal(3, 2, size = (5, 1000))
+    moments = RunningMoments(shape = (5,))
+    for start in range(0, 1000, 137):
+        moments.update(values[:, start:start + 137])
+    assert moments.count == 1000
+    np.testing.assert_allclose(moments.mean, values.mean(axis = 1))
+    np.testing.assert_allclose(moments.variance, np.var(values, axis = 1))
+
+def test_merged_running_moments_match_numpy():
+    rng = np.random.default_rng(1)
+    parts = [rng.normal(loc, 1, size = size) for loc, size in [(0, 10), (100, 3), (-5, 500), (1e6, 1)]]
+    merged = RunningMoments()
+    for part in parts:
+        merged.merge(RunningMoments().update(part))
+    # merging an empty accumulator changes nothing
+    merged.merge(RunningMoments())
+    values = np.concatenate(parts)
+    assert merged.count == len(values)
+    np.testing.assert_allclose(merged.mean, values.mean())
+    np.testing.assert_allclose(merged.variance, np.var(values))
+
+def test_quantile_sketch_is_close_to_exact_quantiles():
+    rng = np.random.default_rng(2)
+    values = rng.normal(size = 200000)
+    sketch = QuantileSketch(capacity = 1024, rng = rng)
+    for block in np.split(values, 100):
+        sketch.update(block)
+    qs = [0.05, 0.5, 0.95]
+    # the rank error of the sketch is a small fraction of the number of values
+    ranks = np.searchsorted(np.sort(values), sketch.quantiles(qs)) / len(values)
+    np.testing.assert_allclose(ranks, qs, atol = 0.01)
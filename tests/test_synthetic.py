@@ -0,0 +1,60 @@
+# Copyright 2022 Cristian Grosu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pandas as pd
+
+from utils.synthetic import COLUMNS, generate_dataset
+
+def test_columns_match_merged_data(tmp_path):
+    file_name = str(tmp_path / "synthetic.csv")
+    generate_dataset(file_name, 100, 3, seed = 0)
+    df = pd.read_csv(file_name)
+    assert list(df.columns) == list(pd.read_csv("data/merged_data.csv", nrows = 0).columns) == COLUMNS
+    assert len(df) == 100
+    assert df["ID"].is_unique
+    assert df[["temperature", "d18_O_w", "d18_O", "d18_O_sd", "d18_O_w_sd"]].notna().all().all()
+
+def test_true_parameters_are_recovered(tmp_path):
+    file_name = str(tmp_path / "synthetic.csv")
+    truth = generate_dataset(file_name, 200000, 4, imbalance = 1.0, measurement_error = False, chunk_size = 50000, seed = 1)
+    df = pd.read_csv(file_name)
+    counts = df["species"].value_counts()
+    residuals = []
+    for name, species in truth["species"].items():
+        rows = df[df["species"] == name]
+        assert counts[name] == species["count"]
+        b, a = np.polyfit(rows["d18_O"] - rows["d18_O_w"], rows["temperature"], 1)
+        assert abs(a - species["a"]) < 0.1
+        assert abs(b - species["b"]) < 0.05
+        residuals.append(rows["temperature"] - a - b * (rows["d18_O"] - rows["d18_O_w"]))
+    assert abs(np.std(np.concatenate(residuals)) - truth["hyperparameters"]["sigma"]) < 0.02
+    # the species frequencies decay as 1 / rank
+    assert list(counts.index) == list(truth["species"])
+
+def test_chunks_do_not_change_the_rows(tmp_path):
+    chunked, whole = str(tmp_path / "chunked.csv"), str(tmp_path / "whole.csv")
+    generate_dataset(chunked, 5000, 5, imbalance = 0.5, chunk_size = 700, seed = 2)
+    generate_dataset(whole, 5000, 5, imbalance = 0.5, seed = 2)
+    with open(chunked, "rb") as f, open(whole, "rb") as g:
+        assert f.read() == g.read()
+
+def test_seed_reproducibility(tmp_path):
+    first, second, other = (str(tmp_path / name) for name in ["first.csv", "second.csv", "other.csv"])
+    assert generate_dataset(first, 1000, 3, seed = 3) == generate_dataset(second, 1000, 3, seed = 3)
+    generate_dataset(other, 1000, 3, seed = 4)
+    with open(first, "rb") as f, open(second, "rb") as g, open(other, "rb") as h:
+        first_bytes = f.read()
+        assert first_bytes == g.read()
+        assert first_bytes != h.read()
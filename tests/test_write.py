@@ -0,0 +1,28 @@
+# Copyright 2022 Cristian Grosu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pandas as pd
+
+from utils.diagnostics import summarize
+from utils.write import DESCRIBE_ROWS, write_summary
+
+def test_results_are_the_rows_of_the_printed_summary(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    draws = np.random.default_rng(0).normal(size = (4, 250, 3))
+    summary = summarize(draws, names = ["a", "b", "sigma"])
+    write_summary(summary, cols = ["a", "b", "sigma"], folder = "Q1")
+    results = pd.read_csv(tmp_path / "results" / "Q1" / "results.txt", index_col = 0)
+    assert list(results.index) == DESCRIBE_ROWS
+    np.testing.assert_allclose(results.to_numpy(), summary.loc[["a", "b", "sigma"], DESCRIBE_ROWS].T.to_numpy(), atol = 5e-4)
@@ -0,0 +1,75 @@
+# Copyright 2022 Cristian Grosu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pandas as pd
+
+def conjugate_posterior(stats, prior_mean = (0.0, 0.0), prior_precision = None, prior_shape = -1.5, prior_rate = 0.0):
+    # Normal-Inverse-Gamma posterior of y ~ normal(a + b * x, sigma) from the sufficient statistics n, sx, sxx, sy, sxy, syy:
+    # (a, b) | sigma^2 ~ normal(mean, sigma^2 precision^-1) and sigma^2 ~ inverse_gamma(shape, rate).
+    # The defaults (zero prior precision, shape -3/2, rate 0) are the flat priors on a, b and sigma of the Q1 and Q3_A programs.
+    n, sx, sxx, sy, sxy, syy = (float(stats[stat]) for stat in ["n", "sx", "sxx", "sy", "sxy", "syy"])
+    prior_mean = np.asarray(prior_mean, dtype = float)
+    prior_precision = np.zeros((2, 2)) if prior_precision is None else np.asarray(prior_precision, dtype = float)
+
+    precision = np.array([[n, sx], [sx, sxx]]) + prior_precision
+    mean = np.linalg.solve(precision, prior_precision @ prior_mean + np.array([sy, sxy]))
+    shape = prior_shape + n / 2
+    rate = prior_rate + 0.5 * (syy + prior_mean @ prior_precision @ prior_mean - mean @ precision @ mean)
+    if shape <= 0 or rate <= 0:
+        raise ValueError("The posterior is improper, more observations are needed")
+
+    return {"mean": mean, "precision": precision, "shape": shape, "rate": rate, "stats": (n, sx, sxx, sy, sxy, syy)}
+
+def sample_conjugate_posterior(posterior, num_samples = 1000, num_chains = 4, batch_size = 10**5, rng = None) -> pd.DataFrame:
+    # i.i.d. draws laid out like fit.to_frame() (chains interleaved, lp__ in front of the parameters)
+    rng = np.random.default_rng() if rng is None else rng
+    num_draws = num_samples * num_chains
+    cholesky = np.linalg.cholesky(posterior["precision"])
+    n, sx, sxx, sy, sxy, syy = posterior["stats"]
+
+    draws = np.empty((num_draws, 4))
+    for start in range(0, num_draws, batch_size):
+        size = min(batch_size, num_draws - start)
+        sigma = np.sqrt(posterior["rate"] / rng.gamma(posterior["shape"], size = size))
+        # precision = L L^T, so L^-T z has covariance precision^-1
+        z = np.linalg.solve(cholesky.T, rng.standard_normal((2, size))).T
+        a, b = (posterior["mean"] + sigma[:, None] * z).T
+
+        # log density up to a constant, as Stan reports it for the flat priors
+        squared_residuals = syy - 2 * a * sy - 2 * b * sxy + n * a ** 2 + 2 * a * b * sx + b ** 2 * sxx
+        draws[start:start + size] = np.column_stack((-n * np.log(sigma) - squared_residuals / (2 * sigma ** 2), a, b, sigma))
+
+    df = pd.DataFrame(draws, columns = ["lp__", "a", "b", "sigma"])
+    df.index.name, df.columns.name = "draws", "parameters"
+    return df
+
+class ConjugatePosterior:
+    # stands in for a built Stan posterior: sample(...).to_frame() gives the draws
+    def __init__(self, stats, random_seed = None, **prior):
+        self.posterior = conjugate_posterior(stats, **prior)
+        self.rng = np.random.default_rng(random_seed)
+
+    def sample(self, num_chains = 4, num_samples = 1000, init = None, num_warmup = None):
+        # the draws are exact and independent, there is no chain state to continue or warm up
+        return SampledFit(sample_conjugate_posterior(self.posterior, num_samples = num_samples, num_chains = num_chains, rng = self.rng), num_chains)
+
+class SampledFit:
+    # draws in the fit.to_frame() layout with the number of chains they interleave
+    def __init__(self, df, num_chains):
+        self.df = df
+        self.num_chains = num_chains
+
+    def to_frame(self) -> pd.DataFrame:
+        return self.df
@@ -0,0 +1,175 @@
+# Copyright 2022 Cristian Grosu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+import numpy as np
+import pandas as pd
+
+from utils.psis import K_THRESHOLD, elpd_kfold, psis_loo
+
+# the pooling strategies of Q3 and their cross validation programs
+MODELS = {"no_pooling": "Q3_A_cv", "partial_pooling": "Q3_B_cv"}
+
+def cross_validate(data_df, engine = "stan", num_folds = 10, workers = None, num_chains = 4, num_samples = 1000, seed = 1):
+    # pointwise elpd of every model: PSIS-LOO from one fit on all the data; the observations whose Pareto k is too high
+    # for the importance sampling estimate get the exact K-fold elpd instead, only the folds that hold them are refitted;
+    # returns the pointwise elpd, the Pareto k and the rows of every model whose elpd comes from the refits
+    num_rows = len(data_df)
+    pointwise, pareto_k = {}, {}
+    for model in MODELS:
+        log_lik = fit_log_lik(model, data_df, np.zeros(num_rows, dtype = bool), engine = engine, num_chains = num_chains, num_samples = num_samples, seed = seed)
+        pointwise[model], pareto_k[model] = psis_loo(log_lik)
+    high_k = {model: k > K_THRESHOLD for model, k in pareto_k.items()}
+    if not any(mask.any() for mask in high_k.values()):
+        return pointwise, pareto_k, high_k
+
+    # the folds do not depend on which observations are refitted, so a fold gets the same seed whichever model needs it
+    folds = assign_folds(data_df["species"], num_folds = num_folds, seed = seed)
+    jobs = [(model, folds == fold, seed + fold + 1) for model in MODELS for fold in np.unique(folds[high_k[model]])]
+
+    if engine == "stan":
+        from utils.model_registry import compile_models
+        compile_models([MODELS[model] for model, _, _ in jobs])
+    if workers is None:
+        # every Stan fit already runs its chains in parallel
+        workers = max(1, (os.cpu_count() or 1) // (num_chains if engine == "stan" else 1))
+
+    kwargs = {"engine": engine, "num_chains": num_chains, "num_samples": num_samples}
+    if workers == 1 or len(jobs) == 1:
+        log_liks = [fit_log_lik(model, data_df, mask, seed = fold_seed, **kwargs) for model, mask, fold_seed in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers = min(workers, len(jobs))) as executor:
+            log_liks = list(executor.map(_fit_log_lik_job, *zip(*[(model, data_df, mask, fold_seed, kwargs) for model, mask, fold_seed in jobs])))
+
+    for model in MODELS:
+        refits = [(log_lik, mask) for (job_model, mask, _), log_lik in zip(jobs, log_liks) if job_model == model]
+        if refits:
+            kfold = elpd_kfold(*zip(*refits))
+            pointwise[model] = np.where(high_k[model], kfold, pointwise[model])
+    return pointwise, pareto_k, high_k
+
+def compare_by_species(pointwise, pareto_k, species, refitted = None, reference = "no_pooling"):
+    # elpd of every model summed per species and over all rows, with the difference to the reference model
+    # and its standard error from the pointwise differences; the method says how many rows of the species
+    # got the K-fold elpd of a refit, in any model, instead of the PSIS-LOO estimate
+    species = np.asarray(species, dtype = object)
+    groups = [(specie, species == specie) for specie in pd.unique(species)] + [("all", np.ones(len(species), dtype = bool))]
+    refitted_rows = np.zeros(len(species), dtype = bool)
+    for mask in (refitted or {}).values():
+        refitted_rows |= mask
+    rows = []
+    for specie, rows_mask in groups:
+        row = {"species": specie, "n": int(rows_mask.sum())}
+        for model, elpd in pointwise.items():
+            row["elpd_" + model] = elpd[rows_mask].sum()
+            row["max_k_" + model] = pareto_k[model][rows_mask].max()
+        for model, elpd in pointwise.items():
+            if model == reference:
+                continue
+            diff = elpd[rows_mask] - pointwise[reference][rows_mask]
+            row[f"elpd_diff_{model}"] = diff.sum()
+            row[f"se_diff_{model}"] = np.sqrt(len(diff) * diff.var(ddof = 1)) if len(diff) > 1 else np.nan
+        num_refitted = int(refitted_rows[rows_mask].sum())
+        row["method"] = f"psis-loo+kfold(n_refit={num_refitted})" if num_refitted else "psis-loo"
+        rows.append(row)
+    return pd.DataFrame(rows).set_index("species")
+
+def assign_folds(species, num_folds = 10, seed = 1):
+    # stratified by species: the shuffled rows of every species are dealt over the folds in turn, continuing where
+    # the previous species stopped, so every fit keeps most of the rows of every species
+    rng = np.random.default_rng(seed)
+    species = np.asarray(species, dtype = object)
+    folds = np.empty(len(species), dtype = int)
+    offset = 0
+    for specie in pd.unique(species):
+        rows = np.flatnonzero(species == specie)
+        folds[rng.permutation(rows)] = (offset + np.arange(len(rows))) % num_folds
+        offset += len(rows)
+    return folds
+
+def fit_log_lik(model, data_df, holdout, engine = "stan", num_chains = 4, num_samples = 1000, seed = 1):
+    # draws x rows log likelihood of every row of data_df under the model fitted without the held out rows;
+    # the stan engine samples the cross validation programs, the gibbs engine the exact conjugate (no pooling)
+    # and Gibbs (partial pooling) posteriors of the sufficient statistics of the kept rows
+    holdout = np.asarray(holdout, dtype = bool)
+    species = np.asarray(data_df["species"], dtype = object)
+    species_order = pd.unique(species)
+    if model == "no_pooling":
+        log_lik = np.empty((num_chains * num_samples, len(data_df)))
+        for specie in species_order:
+            rows = species == specie
+            log_lik[:, rows] = _fit_species_log_lik(data_df[rows], holdout[rows], engine, num_chains, num_samples, seed)
+        return log_lik
+
+    group = pd.Categorical(species, categories = species_order).codes + 1
+    if engine == "stan":
+        from utils.extract import draws_frame
+        from utils.model_registry import get_model
+        data = {
+            "J": len(species_order),
+            "N": len(data_df),
+            "group": group,
+            "d18_O_w": np.asarray(data_df["d18_O_w"], dtype = float),
+            "d18_O_c": np.asarray(data_df["d18_O"], dtype = float),
+            "T": np.asarray(data_df["temperature"], dtype = float),
+            "holdout": holdout.astype(int),
+        }
+        fit = get_model(question = MODELS[model]).build(data, random_seed = seed).sample(num_chains = num_chains, num_samples = num_samples)
+        return draws_frame(fit, include = ["log_lik"]).to_numpy()
+
+    from utils.gibbs import GibbsPosterior
+    from utils.sufficient_stats import sufficient_statistics
+    stats = sufficient_statistics(data_df[~holdout]).reindex(species_order, fill_value = 0.0)
+    df = GibbsPosterior(stats, random_seed = seed).sample(num_chains = num_chains, num_samples = num_samples).to_frame()
+    return pointwise_log_lik(df, *_xy(data_df), group = group)
+
+def pointwise_log_lik(df, x, y, group = None):
+    # normal log likelihood of y given a + b * x for every draw and row; with the 1-based group index of the rows
+    # the coefficients are the a.j and b.j columns of the partial pooling draws
+    if group is None:
+        a, b = df["a"].to_numpy()[:, None], df["b"].to_numpy()[:, None]
+    else:
+        num_groups = int(group.max())
+        a = df[[f"a.{j + 1}" for j in range(num_groups)]].to_numpy()[:, group - 1]
+        b = df[[f"b.{j + 1}" for j in range(num_groups)]].to_numpy()[:, group - 1]
+    sigma = df["sigma"].to_numpy()[:, None]
+    return -0.5 * np.log(2 * np.pi) - np.log(sigma) - 0.5 * ((y - a - b * x) / sigma) ** 2
+
+def _fit_species_log_lik(data_df_species, holdout, engine, num_chains, num_samples, seed):
+    if engine == "stan":
+        from utils.extract import draws_frame
+        from utils.model_registry import get_model
+        data = {
+            "N": len(data_df_species),
+            "d18_O_w": np.asarray(data_df_species["d18_O_w"], dtype = float),
+            "d18_O_c": np.asarray(data_df_species["d18_O"], dtype = float),
+            "y": np.asarray(data_df_species["temperature"], dtype = float),
+            "holdout": holdout.astype(int),
+        }
+        fit = get_model(question = MODELS["no_pooling"]).build(data, random_seed = seed).sample(num_chains = num_chains, num_samples = num_samples)
+        return draws_frame(fit, include = ["log_lik"]).to_numpy()
+
+    from utils.conjugate import ConjugatePosterior
+    from utils.sufficient_stats import sufficient_statistics
+    df = ConjugatePosterior(sufficient_statistics(data_df_species[~holdout]).iloc[0], random_seed = seed).sample(num_chains = num_chains, num_samples = num_samples).to_frame()
+    return pointwise_log_lik(df, *_xy(data_df_species))
+
+def _fit_log_lik_job(model, data_df, holdout, seed, kwargs):
+    return fit_log_lik(model, data_df, holdout, seed = seed, **kwargs)
+
+def _xy(data_df):
+    x = np.asarray(data_df["d18_O"], dtype = float) - np.asarray(data_df["d18_O_w"], dtype = float)
+    return x, np.asarray(data_df["temperature"], dtype = float)
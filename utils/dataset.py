@@ -0,0 +1,159 @@
+# Copyright 2022 Cristian Grosu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from utils.fileio import atomic_write, locked
+
+CACHE_FOLDER = ".data_cache"
+
+FLOAT64_COLS = ["temperature", "d18_O_w", "d18_O"]
+FLOAT32_COLS = ["d18_O_sd", "d18_O_w_sd"]
+CATEGORICAL_COLS = ["paper", "location", "species", "class", "functional_group", "composition"]
+
+class Dataset:
+    def __init__(self, columns, categories, species_order, species_offsets):
+        self.columns = columns
+        self.categories = categories
+        self.species_order = species_order
+        self.species_offsets = species_offsets
+
+    @property
+    def num_rows(self):
+        return len(self.columns["species"])
+
+    @property
+    def species(self):
+        # in order of first appearance in the csv, same as data_df["species"].unique()
+        return np.array(self.categories["species"], dtype = object)
+
+    @property
+    def group(self):
+        # 1-based species index of every row, as the Stan programs expect it
+        return np.asarray(self.columns["species"]) + 1
+
+    def species_rows(self, species):
+        j = species if isinstance(species, (int, np.integer)) else self.categories["species"].index(species)
+        return self.species_order[self.species_offsets[j]:self.species_offsets[j + 1]]
+
+    def __getitem__(self, col):
+        return self.columns[col]
+
+    def frame(self, species = None) -> pd.DataFrame:
+        rows = slice(None) if species is None else self.species_rows(species)
+        data = {}
+        for col, values in self.columns.items():
+            values = np.asarray(values[rows])
+            if col in self.categories:
+                values = pd.Categorical.from_codes(values, categories = self.categories[col])
+            data[col] = values
+        return pd.DataFrame(data)
+
+def load_dataset(filename, cols = None) -> Dataset:
+    # parses the csv once into typed columns, later calls memory map the columns they ask for from the cache
+    # concurrent processes (pool workers, pipeline jobs) read the cache under a shared lock, a rebuild takes it exclusively
+    cache = _cache_folder(filename)
+    with locked(cache, shared = True):
+        meta = _read_meta(cache)
+        if _is_valid(meta, filename):
+            return _open_dataset(cache, meta, cols)
+    with locked(cache):
+        # another process may have rebuilt it while this one waited for the lock
+        meta = _read_meta(cache)
+        if not _is_valid(meta, filename):
+            meta = _build_cache(filename, cache)
+        return _open_dataset(cache, meta, cols)
+
+def _open_dataset(cache, meta, cols):
+    if cols is None:
+        cols = meta["columns"]
+    # the species codes back the group index, they are always loaded
+    cols = list(cols) + (["species"] if "species" not in cols else [])
+    columns = {col: np.load(os.path.join(cache, col + ".npy"), mmap_mode = "r") for col in cols}
+    categories = {col: meta["categories"][col] for col in cols if col in meta["categories"]}
+    species_order = np.load(os.path.join(cache, "species_order.npy"))
+    species_offsets = np.load(os.path.join(cache, "species_offsets.npy"))
+    return Dataset(columns, categories, species_order, species_offsets)
+
+def _cache_folder(filename):
+    path = os.path.abspath(filename)
+    return os.path.join(CACHE_FOLDER, os.path.basename(path) + "-" + hashlib.sha256(path.encode("utf-8")).hexdigest()[:8])
+
+def _file_hash(filename):
+    digest = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(2**20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _read_meta(cache):
+    if not os.path.exists(os.path.join(cache, "meta.json")):
+        return None
+    with open(os.path.join(cache, "meta.json"), "r") as f:
+        return json.load(f)
+
+def _is_valid(meta, filename):
+    if meta is None:
+        return False
+    stat = os.stat(filename)
+    if meta["mtime"] == stat.st_mtime and meta["size"] == stat.st_size:
+        return True
+    # touched but not edited, the cache is still good
+    if meta["size"] == stat.st_size and meta["sha256"] == _file_hash(filename):
+        meta["mtime"] = stat.st_mtime
+        _write_meta(_cache_folder(filename), meta)
+        return True
+    return False
+
+def _write_meta(cache, meta):
+    atomic_write(os.path.join(cache, "meta.json"), json.dumps(meta, indent = 2))
+
+def _save(cache, name, values):
+    # a column replaces the old file instead of overwriting it, so the memory maps of earlier datasets stay valid
+    atomic_write(os.path.join(cache, name + ".npy"), lambda f: np.save(f, values))
+
+def _build_cache(filename, cache):
+    stat = os.stat(filename)
+    dtypes = {col: np.float64 for col in FLOAT64_COLS}
+    dtypes.update({col: np.float32 for col in FLOAT32_COLS})
+    df = pd.read_csv(filename, dtype = dtypes)
+
+    os.makedirs(cache, exist_ok = True)
+    categories = {}
+    for col in df.columns:
+        if col in CATEGORICAL_COLS or df[col].dtype == object:
+            # categories keep the order of first appearance, missing values get the code -1
+            values = pd.Categorical(df[col], categories = pd.unique(df[col].dropna()))
+            categories[col] = [str(value) for value in values.categories]
+            values = values.codes.astype(np.int32)
+        else:
+            values = df[col].to_numpy()
+        _save(cache, col, values)
+
+    # rows of each species are contiguous in species_order, species j spans species_offsets[j]:species_offsets[j + 1]
+    species_codes = np.load(os.path.join(cache, "species.npy"))
+    species_order = np.argsort(species_codes, kind = "stable")
+    species_offsets = np.concatenate(([0], np.cumsum(np.bincount(species_codes, minlength = len(categories["species"])))))
+    _save(cache, "species_order", species_order)
+    _save(cache, "species_offsets", species_offsets)
+
+    # meta.json is written last, until then the old meta does not match the csv and the cache counts as stale
+    meta = {"mtime": stat.st_mtime, "size": stat.st_size, "sha256": _file_hash(filename), "columns": list(df.columns), "categories": categories}
+    _write_meta(cache, meta)
+    return meta
@@ -0,0 +1,122 @@
+# Copyright 2022 Cristian Grosu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pandas as pd
+from scipy.special import ndtri
+
+# convergence diagnostics of Vehtari et al. (2021), the functions take a chains x draws x parameters array
+# and summarize returns one row per parameter
+
+def split_chains(draws):
+    # the first and second half of every chain become two chains, an odd middle draw is dropped
+    draws = np.asarray(draws, dtype = float)
+    half = draws.shape[1] // 2
+    return np.concatenate((draws[:, :half], draws[:, draws.shape[1] - half:]), axis = 0)
+
+def rank_normalize(draws):
+    # normal scores of the ranks over all chains and draws, ties get their average rank
+    from scipy.stats import rankdata
+    num_chains, num_draws, num_params = draws.shape
+    ranks = rankdata(draws.reshape(-1, num_params), axis = 0)
+    return ndtri((ranks - 3 / 8) / (num_chains * num_draws + 1 / 4)).reshape(draws.shape)
+
+def summarize(draws, names = None, quantiles = (0.05, 0.25, 0.5, 0.75, 0.95)) -> pd.DataFrame:
+    # every statistic of the console table and of results.txt in one pass over the chains x draws x parameters array:
+    # the split chains and their normal scores are computed once and shared by R-hat and the effective sample sizes
+    draws = np.asarray(draws, dtype = float)
+    num_chains, num_draws, num_params = draws.shape
+    flat = draws.reshape(-1, num_params)
+    mean = flat.mean(axis = 0)
+    std = flat.std(axis = 0, ddof = 1)
+    values = np.quantile(flat, [0.0] + list(quantiles) + [1.0], axis = 0)
+
+    split = split_chains(draws)
+    split_flat = split.reshape(-1, num_params)
+    normal_scores = rank_normalize(split)
+    folded_scores = rank_normalize(np.abs(split - np.median(split_flat, axis = 0)))
+    tails = np.quantile(flat, [0.05, 0.95], axis = 0)
+    ess_mean = _ess(split)
+    # the effective sample size of the sd is limited by both the first and the second moment
+    ess_sd = np.minimum(ess_mean, _ess(split ** 2))
+
+    df = pd.DataFrame({"count": float(num_chains * num_draws), "mean": mean, "std": std, "min": values[0]}, index = names)
+    for q, value in zip(quantiles, values[1:-1]):
+        df[f"{100 * q:g}%"] = value
+    df["max"] = values[-1]
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        df["mcse_mean"] = std / np.sqrt(ess_mean)
+        df["mcse_sd"] = std * np.sqrt(np.e * (1 - 1 / ess_sd) ** (ess_sd - 1) - 1)
+    df["ess_bulk"] = _ess(normal_scores)
+    df["ess_tail"] = np.minimum(_ess((split <= tails[0]).astype(float)), _ess((split <= tails[1]).astype(float)))
+    df["r_hat"] = np.maximum(_rhat(normal_scores), _rhat(folded_scores))
+    df.index.name = "parameters"
+    return df
+
+def summarize_frame(df, num_chains, cols = None, quantiles = (0.05, 0.25, 0.5, 0.75, 0.95)) -> pd.DataFrame:
+    # draws in the fit.to_frame() layout, the sampler columns (__) are left out by default
+    if cols is None:
+        cols = [col for col in df.columns if not col.endswith("__")]
+    draws = np.asarray(df[cols], dtype = float).reshape(len(df) // num_chains, num_chains, len(cols)).transpose(1, 0, 2)
+    return summarize(draws, names = cols, quantiles = quantiles)
+
+def _rhat(draws):
+    num_draws = draws.shape[1]
+    chain_means = draws.mean(axis = 1)
+    within = draws.var(axis = 1, ddof = 1).mean(axis = 0)
+    between = num_draws * chain_means.var(axis = 0, ddof = 1)
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        return np.sqrt(((num_draws - 1) / num_draws * within + between / num_draws) / within)
+
+def _autocovariance(draws):
+    # autocovariance of every chain and parameter along the draws, through the FFT
+    num_draws = draws.shape[1]
+    centered = draws - draws.mean(axis = 1, keepdims = True)
+    size = 2 ** int(np.ceil(np.log2(2 * num_draws)))
+    transform = np.fft.rfft(centered, n = size, axis = 1)
+    return np.fft.irfft(transform * np.conj(transform), n = size, axis = 1)[:, :num_draws] / num_draws
+
+def _ess(draws):
+    # Geyer's initial monotone sequence estimator on the autocorrelations averaged over the chains
+    num_chains, num_draws, num_params = draws.shape
+    if num_draws < 4:
+        return np.full(num_params, np.nan)
+    autocovariance = _autocovariance(draws)
+    chain_variance = autocovariance[:, 0] * num_draws / (num_draws - 1)
+    within = chain_variance.mean(axis = 0)
+    variance = within * (num_draws - 1) / num_draws
+    if num_chains > 1:
+        variance = variance + draws.mean(axis = 1).var(axis = 0, ddof = 1)
+
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        rho = 1 - (within - autocovariance.mean(axis = 0)) / variance
+    rho[0] = 1
+
+    # Geyer's initial positive sequence: sums of consecutive pairs of autocorrelations stay positive for a reversible chain,
+    # the sum stops before the first pair that is not positive (last); the monotone sequence makes the included pairs
+    # non-increasing, and the even autocorrelation of the last pair is added once, as in Stan
+    num_pairs = max(1, (num_draws - 1) // 2)
+    pairs = rho[0:2 * num_pairs:2] + rho[1:2 * num_pairs:2]
+    not_positive = pairs[1:] <= 0
+    last = np.where(not_positive.any(axis = 0), np.argmax(not_positive, axis = 0) + 1, num_pairs - 1)
+    last = np.where(pairs[0] > 0, last, 0)
+    included = np.arange(num_pairs)[:, None] < last
+    monotone = np.minimum.accumulate(np.where(included, pairs, np.inf), axis = 0)
+    columns = np.arange(num_params)
+    last_even = rho[2 * last, columns]
+    last_even = np.where((last_even > 0) | ((pairs[last, columns] >= 0) & (last > 0)), last_even, 0)
+    tau = np.maximum(-1 + 2 * np.where(included, monotone, 0).sum(axis = 0) + last_even, 1 / np.log10(num_chains * num_draws))
+    ess = num_chains * num_draws / tau
+    # constant parameters have no meaningful effective sample size
+    return np.where(variance > 0, ess, np.nan)
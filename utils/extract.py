@@ -0,0 +1,83 @@
+# Copyright 2022 Cristian Grosu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Dict, List
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+def draw_names(fit) -> List[str]:
+    # flat names in the fit.to_frame() column order, e.g. "lp__", "a", "y_new.1"
+    if hasattr(fit, "_draws"):
+        return list(fit.sample_and_sampler_param_names) + list(fit.constrained_param_names)
+    return list(fit.to_frame().columns)
+
+def select_names(names, include = None, exclude = None) -> List[str]:
+    # a parameter name selects all its entries ("y_new" selects "y_new.1", "y_new.2", ...), a flat name only itself
+    def matches(name, patterns):
+        return any(name == pattern or name.split(".")[0] == pattern for pattern in patterns)
+    return [name for name in names if (include is None or matches(name, include)) and not (exclude is not None and matches(name, exclude))]
+
+def extract_draws(fit, include = None, exclude = None, dtype = None, thin = 1) -> Dict[str, np.ndarray]:
+    # (chains, draws) array of every selected column; for a Stan fit without a dtype these are views on the sampler output,
+    # nothing is copied and no data frame is built
+    names = draw_names(fit)
+    selected = select_names(names, include, exclude)
+    columns = {name: i for i, name in enumerate(names)}
+    draws = {}
+    for name in selected:
+        values = _chain_draws(fit, columns, name)[:, ::thin]
+        draws[name] = values if dtype is None else values.astype(dtype)
+    return draws
+
+def draws_frame(fit, include = None, exclude = None, dtype = None, thin = 1) -> pd.DataFrame:
+    # the selected columns only, laid out like fit.to_frame()
+    draws = extract_draws(fit, include = include, exclude = exclude, dtype = dtype, thin = thin)
+    df = pd.DataFrame({name: values.T.reshape(-1) for name, values in draws.items()})
+    df.index.name, df.columns.name = "draws", "parameters"
+    return df
+
+def stream_draws(fit, include = None, exclude = None, dtype = np.float32, thin = 1, folder = "Q1", store_name = "draws"):
+    # writes the selected columns to the draw store of utils.write.write_draws one chain at a time,
+    # every .npy file is filled through a memory map so at most one chain of one column is converted at once
+    store = os.path.join("results", folder, store_name)
+    os.makedirs(store, exist_ok = True)
+    names = draw_names(fit)
+    selected = select_names(names, include, exclude)
+    columns = {name: i for i, name in enumerate(names)}
+
+    num_chains = num_draws = 0
+    for name in selected:
+        values = _chain_draws(fit, columns, name)[:, ::thin]
+        num_chains, num_draws = values.shape
+        out = np.lib.format.open_memmap(os.path.join(store, name + ".npy"), mode = "w+", dtype = dtype, shape = values.shape)
+        for chain in range(num_chains):
+            out[chain] = values[chain]
+        out.flush()
+        del out
+
+    meta = {"params": selected, "num_chains": num_chains, "num_draws": num_draws, "dtype": np.dtype(dtype).name}
+    with open(os.path.join(store, "meta.json"), "w") as f:
+        json.dump(meta, f, indent = 2)
+    return store
+
+def _chain_draws(fit, columns, name):
+    # columns maps every flat name to its position, built once per fit so a selection of K names costs O(K)
+    if hasattr(fit, "_draws"):
+        # the sampler output is a (columns, draws, chains) array
+        return fit._draws[columns[name]].T
+    df = fit.to_frame()
+    return np.asarray(df[name]).reshape(len(df) // fit.num_chains, fit.num_chains).T
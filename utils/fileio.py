@@ -0,0 +1,51 @@
+# Copyright 2022 Cristian Grosu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from contextlib import contextmanager
+import os
+import threading
+
+@contextmanager
+def locked(path, shared = False):
+    # read, modify and write of path by concurrent processes (pool workers, pipeline jobs) are serialized by a lock
+    # on a file next to it, readers may share it; without fcntl (Windows) the atomic writes still avoid torn files
+    os.makedirs(os.path.dirname(path) or ".", exist_ok = True)
+    with open(path + ".lock", "w") as lock_file:
+        try:
+            import fcntl
+        except ImportError:
+            fcntl = None
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def atomic_write(path, data):
+    # data is a str, bytes or a function that writes to the open binary file; it goes to a temporary file first and
+    # replaces path in one step, so readers never see a partial file and open memory maps of the old one stay valid
+    os.makedirs(os.path.dirname(path) or ".", exist_ok = True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            if callable(data):
+                data(f)
+            else:
+                f.write(data.encode("utf-8") if isinstance(data, str) else data)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
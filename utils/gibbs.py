@@ -0,0 +1,157 @@
+# Copyright 2022 Cristian Grosu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pandas as pd
+
+from utils.conjugate import SampledFit
+
+# priors of stan_code_q3_mix_pooling
+A_BOUNDS = (-2.0, 50.0)
+B_PRIOR = (0.0, 1.0)
+SIGMA_A_PRIOR = (1.0, 1.0)
+SIGMA_B_PRIOR = (0.5, 0.5)
+
+def sample_mix_pooling(stats, num_chains = 4, num_samples = 1000, num_warmup = 1000, rng = None, init = None, steps = None) -> pd.DataFrame:
+    # Gibbs sampler of the partial pooling model from the per species sufficient statistics (one row per species, in group order),
+    # every array carries the chains on its leading axis so all chains and all species are updated at once.
+    # init continues the chains from one dict of parameter values per chain (the Stan init format), steps are the
+    # 2 x chains x 1 Metropolis step sizes of the group scales, tuned in place during the warmup
+    rng = np.random.default_rng() if rng is None else rng
+    n, sx, sxx, sy, sxy, syy = (stats[stat].to_numpy(dtype = float)[None, :] for stat in ["n", "sx", "sxx", "sy", "sxy", "syy"])
+    J = n.shape[1]
+    N = n.sum()
+
+    if init is not None:
+        # only the hyperparameters and sigma are needed, the coefficients are the first draw of every iteration
+        A, B, sigma, sigma_a, sigma_b = (np.array([[chain[name]] for chain in init], dtype = float) for name in ["A", "B", "sigma", "sigma_a", "sigma_b"])
+    else:
+        # start every chain around the complete pooling least squares fit
+        pooled_b = (N * sxy.sum() - sx.sum() * sy.sum()) / (N * sxx.sum() - sx.sum() ** 2)
+        pooled_a = (sy.sum() - pooled_b * sx.sum()) / N
+        A = np.clip(pooled_a + rng.normal(0, 1, size = (num_chains, 1)), *A_BOUNDS)
+        B = pooled_b + rng.normal(0, 0.5, size = (num_chains, 1))
+        sigma = np.full((num_chains, 1), np.sqrt(_squared_residuals(np.repeat(A, J, axis = 1), np.repeat(B, J, axis = 1), n, sx, sxx, sy, sxy, syy).sum() / N))
+        sigma_a = np.full((num_chains, 1), SIGMA_A_PRIOR[0])
+        sigma_b = np.full((num_chains, 1), SIGMA_B_PRIOR[0])
+    steps = np.full((2, num_chains, 1), 0.5) if steps is None else steps
+
+    columns = ["lp__", "A", "B"] + [f"a.{j + 1}" for j in range(J)] + [f"b.{j + 1}" for j in range(J)] + ["sigma", "sigma_a", "sigma_b"]
+    draws = np.empty((num_samples, num_chains, len(columns)))
+    for iteration in range(num_warmup + num_samples):
+        a, b = _sample_coefficients(A, B, sigma, sigma_a, sigma_b, n, sx, sxx, sy, sxy, rng)
+        A = _sample_truncated_normal(a.mean(axis = 1, keepdims = True), sigma_a / np.sqrt(J), *A_BOUNDS, rng)
+        B = _sample_slope_mean(b, sigma_b, rng)
+
+        # flat prior on sigma: sigma^2 | rest ~ inverse_gamma((N - 1) / 2, RSS / 2)
+        rss = _squared_residuals(a, b, n, sx, sxx, sy, sxy, syy).sum(axis = 1, keepdims = True)
+        sigma = np.sqrt(rss / 2 / rng.gamma((N - 1) / 2, size = (num_chains, 1)))
+
+        # the half normal priors of the group scales are not conjugate, they get a random walk Metropolis step on the log scale
+        sigma_a, accepted_a = _metropolis_scale(sigma_a, a - A, SIGMA_A_PRIOR, steps[0], rng)
+        sigma_b, accepted_b = _metropolis_scale(sigma_b, b - B, SIGMA_B_PRIOR, steps[1], rng)
+        if iteration < num_warmup:
+            # tune the step sizes towards the 0.44 acceptance rate of one dimensional random walks
+            rate = 1 / np.sqrt(iteration + 1)
+            steps *= np.exp(rate * (np.stack((accepted_a, accepted_b)) - 0.44))
+            continue
+
+        lp = _log_density(A, B, a, b, sigma, sigma_a, sigma_b, rss, n.sum())
+        draws[iteration - num_warmup] = np.hstack((lp, A, B, a, b, sigma, sigma_a, sigma_b))
+
+    # draw major with the chains interleaved, as fit.to_frame() orders them
+    df = pd.DataFrame(draws.reshape(num_samples * num_chains, len(columns)), columns = columns)
+    df.index.name, df.columns.name = "draws", "parameters"
+    return df
+
+def _squared_residuals(a, b, n, sx, sxx, sy, sxy, syy):
+    return syy - 2 * a * sy - 2 * b * sxy + n * a ** 2 + 2 * a * b * sx + b ** 2 * sxx
+
+def _sample_coefficients(A, B, sigma, sigma_a, sigma_b, n, sx, sxx, sy, sxy, rng):
+    # (a_j, b_j) | rest ~ normal(precision^-1 h, precision^-1), one 2x2 system per chain and species solved in closed form
+    variance = sigma ** 2
+    p11 = n / variance + 1 / sigma_a ** 2
+    p12 = sx / variance
+    p22 = sxx / variance + 1 / sigma_b ** 2
+    h1 = sy / variance + A / sigma_a ** 2
+    h2 = sxy / variance + B / sigma_b ** 2
+
+    determinant = p11 * p22 - p12 ** 2
+    mean_a = (p22 * h1 - p12 * h2) / determinant
+    mean_b = (p11 * h2 - p12 * h1) / determinant
+
+    # precision = L L^T with L = [[l11, 0], [l21, l22]], L^-T z has covariance precision^-1
+    l11 = np.sqrt(p11)
+    l21 = p12 / l11
+    l22 = np.sqrt(p22 - l21 ** 2)
+    z1, z2 = rng.standard_normal((2,) + mean_a.shape)
+    noise_b = z2 / l22
+    noise_a = (z1 - l21 * noise_b) / l11
+    return mean_a + noise_a, mean_b + noise_b
+
+def _sample_truncated_normal(mean, std, lower, upper, rng):
+    # rejection sampling, the posterior of A sits well inside its uniform prior so few rounds are needed
+    sample = rng.normal(mean, std)
+    rejected = (sample < lower) | (sample > upper)
+    for _ in range(100):
+        if not rejected.any():
+            return sample
+        sample = np.where(rejected, rng.normal(mean, std), sample)
+        rejected = (sample < lower) | (sample > upper)
+    return np.clip(sample, lower, upper)
+
+def _sample_slope_mean(b, sigma_b, rng):
+    prior_mean, prior_std = B_PRIOR
+    precision = 1 / prior_std ** 2 + b.shape[1] / sigma_b ** 2
+    mean = (prior_mean / prior_std ** 2 + b.sum(axis = 1, keepdims = True) / sigma_b ** 2) / precision
+    return rng.normal(mean, 1 / np.sqrt(precision))
+
+def _log_scale_density(log_scale, deviations, prior):
+    # log density of log(scale) given the group deviations, with the half normal prior and the jacobian of the log transform
+    scale = np.exp(log_scale)
+    return -deviations.shape[1] * log_scale - (deviations ** 2).sum(axis = 1, keepdims = True) / (2 * scale ** 2) - (scale - prior[0]) ** 2 / (2 * prior[1] ** 2) + log_scale
+
+def _metropolis_scale(scale, deviations, prior, step, rng):
+    current = np.log(scale)
+    proposal = current + step * rng.standard_normal(current.shape)
+    log_ratio = _log_scale_density(proposal, deviations, prior) - _log_scale_density(current, deviations, prior)
+    accepted = np.log(rng.uniform(size = current.shape)) < log_ratio
+    return np.exp(np.where(accepted, proposal, current)), accepted
+
+def _log_density(A, B, a, b, sigma, sigma_a, sigma_b, rss, N):
+    # log joint density up to a constant
+    return (
+        -N * np.log(sigma) - rss / (2 * sigma ** 2)
+        - a.shape[1] * np.log(sigma_a) - ((a - A) ** 2).sum(axis = 1, keepdims = True) / (2 * sigma_a ** 2)
+        - b.shape[1] * np.log(sigma_b) - ((b - B) ** 2).sum(axis = 1, keepdims = True) / (2 * sigma_b ** 2)
+        - (B - B_PRIOR[0]) ** 2 / (2 * B_PRIOR[1] ** 2)
+        - (sigma_a - SIGMA_A_PRIOR[0]) ** 2 / (2 * SIGMA_A_PRIOR[1] ** 2)
+        - (sigma_b - SIGMA_B_PRIOR[0]) ** 2 / (2 * SIGMA_B_PRIOR[1] ** 2)
+    )
+
+class GibbsPosterior:
+    # stands in for the built Stan posterior of the partial pooling model
+    def __init__(self, stats, random_seed = None, num_warmup = 1000):
+        self.stats = stats
+        self.num_warmup = num_warmup
+        self.rng = np.random.default_rng(random_seed)
+        self.steps = None
+
+    def sample(self, num_chains = 4, num_samples = 1000, init = None, num_warmup = None):
+        # as with Stan, init continues the chains from their last draws and num_warmup overrides the default warmup;
+        # the tuned Metropolis steps of the chains are kept for the next call
+        if self.steps is None or self.steps.shape[1] != num_chains:
+            self.steps = np.full((2, num_chains, 1), 0.5)
+        num_warmup = self.num_warmup if num_warmup is None else num_warmup
+        return SampledFit(sample_mix_pooling(self.stats, num_chains = num_chains, num_samples = num_samples, num_warmup = num_warmup, rng = self.rng, init = init, steps = self.steps), num_chains)
@@ -0,0 +1,160 @@
+# Copyright 2022 Cristian Grosu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import ast
+from functools import lru_cache
+import importlib
+import importlib.abc
+import importlib.util
+import os
+import sys
+import time
+
+def resolve_handler(spec):
+    # "module:function", the module (and everything it imports) is only loaded here
+    module_name, function_name = spec.split(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+def run_handler(spec, *args, **kwargs):
+    # module level, so a handler can be sent to a worker process by name
+    return resolve_handler(spec)(*args, **kwargs)
+
+def handler_source(spec):
+    # source of the handler function read from its file, without importing the module
+    module_name, function_name = spec.split(":")
+    module_spec = importlib.util.find_spec(module_name)
+    with open(module_spec.origin, "r") as f:
+        source = f.read()
+    for node in ast.parse(source).body:
+        if isinstance(node, ast.FunctionDef) and node.name == function_name:
+            return ast.get_source_segment(source, node)
+    raise ValueError(f"{function_name} not found in {module_name}")
+
+def imported_sources(spec):
+    # {module: source} of the project modules the handler module imports, directly or through other project modules,
+    # including the imports inside functions; the files are parsed, not imported, and third party modules are left out
+    module_name = spec.split(":")[0]
+    root = os.path.dirname(importlib.util.find_spec(module_name.split(".")[0]).origin)
+    sources, pending = {}, [module_name]
+    while pending:
+        for name in _project_imports(pending.pop(), root):
+            if name not in sources and name != module_name:
+                sources[name] = _module_source(name)[1]
+                pending.append(name)
+    return dict(sorted(sources.items()))
+
+def _module_source(module_name):
+    origin = importlib.util.find_spec(module_name).origin
+    stat = os.stat(origin)
+    return origin, _read_source(origin, stat.st_mtime_ns, stat.st_size)
+
+@lru_cache(maxsize = None)
+def _read_source(path, mtime_ns, size):
+    # keyed by the state of the file, an edited module is read again by a long running process
+    with open(path, "r") as f:
+        return f.read()
+
+def _project_imports(module_name, root):
+    return _imports_of(_module_source(module_name)[1], root)
+
+@lru_cache(maxsize = None)
+def _imports_of(source, root):
+    imports = set()
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node, ast.Import):
+            candidates = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module is not None:
+            # "from utils import write" names a module, "from utils.write import write_draws" a function of one
+            candidates = [node.module] + [node.module + "." + alias.name for alias in node.names]
+        else:
+            continue
+        for candidate in candidates:
+            if _is_project_module(candidate, root):
+                imports.add(candidate)
+    return frozenset(imports)
+
+def _is_project_module(module_name, root):
+    # looked up one package at a time, a lookup imports the parent package and must not import a third party
+    # package or a project module ("utils.write.write_draws" is a function, not a submodule of utils.write)
+    parts = module_name.split(".")
+    try:
+        for depth in range(1, len(parts) + 1):
+            module_spec = importlib.util.find_spec(".".join(parts[:depth]))
+            if module_spec is None:
+                return False
+            locations = [module_spec.origin or ""] + list(module_spec.submodule_search_locations or [])
+            if not any(path.startswith(root + os.sep) for path in locations):
+                return False
+            if depth < len(parts) and module_spec.submodule_search_locations is None:
+                return False
+    except (ImportError, ValueError):
+        return False
+    return module_spec.origin is not None and module_spec.origin.endswith(".py")
+
+class ImportTimer(importlib.abc.MetaPathFinder):
+    # meta path finder that times the execution of every module imported after install(),
+    # the self time of a module excludes the modules it imports itself
+    def __init__(self):
+        self.times = {}
+        self.stack = []
+
+    def install(self):
+        sys.meta_path.insert(0, self)
+        return self
+
+    def uninstall(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def find_spec(self, fullname, path, target = None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                    spec.loader = _TimedLoader(spec.loader, self)
+                return spec
+        return None
+
+    def report(self, limit = 20):
+        rows = sorted(self.times.items(), key = lambda item: item[1][0], reverse = True)[:limit]
+        lines = [f"{'module':<50} {'self [s]':>10} {'cumulative [s]':>15}"]
+        for name, (total, own) in rows:
+            lines.append(f"{name:<50} {own:>10.3f} {total:>15.3f}")
+        return "\n".join(lines)
+
+class _TimedLoader(importlib.abc.Loader):
+    def __init__(self, loader, timer):
+        self.loader = loader
+        self.timer = timer
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        self.timer.stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            self.loader.exec_module(module)
+        finally:
+            total = time.perf_counter() - start
+            children = self.timer.stack.pop()
+            if self.timer.stack:
+                self.timer.stack[-1] += total
+            self.timer.times[module.__name__] = (total, total - children)
+
+    def __getattr__(self, name):
+        # resource readers and the like come from the wrapped loader
+        return getattr(self.loader, name)
@@ -0,0 +1,172 @@
+# Copyright 2022 Cristian Grosu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import os
+import re
+import time
+
+from utils.fileio import atomic_write, locked
+from utils.stan_models import get_stan_code, stan_question
+
+CACHE_FOLDER = ".stan_cache"
+REGISTRY_FILE = "registry.json"
+
+# compiled models of the current process, keyed by registry key
+_loaded_models = {}
+
+def normalize_stan_code(stan_code: str) -> str:
+    # drop comments, indentation and blank lines so that cosmetic edits do not trigger a recompilation
+    stan_code = re.sub(r"/\*.*?\*/", "", stan_code, flags=re.DOTALL)
+    lines = [re.sub(r"//.*$", "", line).strip() for line in stan_code.splitlines()]
+    lines = [re.sub(r"\s+", " ", line) for line in lines if line]
+    return "\n".join(lines) + "\n"
+
+def toolchain_version() -> str:
+    import httpstan
+    import stan
+    return f"pystan-{stan.__version__}/httpstan-{httpstan.__version__}"
+
+def model_key(stan_code: str) -> str:
+    content = normalize_stan_code(stan_code) + toolchain_version()
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+
+class CompiledModel:
+    def __init__(self, key, stan_code, question = None):
+        self.key = key
+        self.stan_code = stan_code
+        self.question = question
+        self.model_name = None
+
+    def compile(self):
+        # compiling without data, the shared object ends up in the httpstan model cache
+        import asyncio
+        import stan
+
+        async def build():
+            async with stan.common.HttpstanClient() as client:
+                resp = await client.post("/models", json = {"program_code": self.stan_code})
+                if resp.status != 201:
+                    raise RuntimeError(resp.json()["message"])
+                return resp.json()["name"]
+
+        self.model_name = asyncio.run(build())
+        _touch_registry_entry(self)
+        return self
+
+    def build(self, data, random_seed = None):
+        # binding new data to an already compiled program does not recompile it
+        import stan
+        if self.model_name is None:
+            self.compile()
+        else:
+            _touch_registry_entry(self)
+        return stan.build(self.stan_code, data = data, random_seed = random_seed)
+
+def get_model(question = "Q1", stan_code = None, parameterization = "centered") -> CompiledModel:
+    if stan_code is None:
+        stan_code = get_stan_code(question = question, parameterization = parameterization)
+        question = stan_question(question, parameterization)
+    key = model_key(stan_code)
+
+    if key not in _loaded_models:
+        model = CompiledModel(key, normalize_stan_code(stan_code), question = question)
+        entry = _read_registry().get(key)
+        if entry is not None and _is_compiled(entry["model_name"]):
+            model.model_name = entry["model_name"]
+        _loaded_models[key] = model
+
+    return _loaded_models[key]
+
+def compile_models(questions):
+    # compiles the programs that are not in the cache yet, once, before worker processes that would all compile them
+    # at the same time; the workers then find them in the registry
+    for question in dict.fromkeys(questions):
+        model = get_model(question = question)
+        if model.model_name is None:
+            model.compile()
+
+def purge_model_cache(max_age_days = 30, max_entries = None):
+    # removes the compiled models not used for max_age_days, or beyond the max_entries most recently used ones,
+    # from the httpstan cache where their shared objects live, together with their registry entries
+    with locked(_registry_path()):
+        registry = _read_registry()
+        now = time.time()
+
+        # most recently used models first
+        entries = sorted(registry.items(), key = lambda item: item[1]["last_used"], reverse = True)
+        keep, purged = {}, {}
+        for key, entry in entries:
+            too_old = max_age_days is not None and now - entry["last_used"] > max_age_days * 24 * 3600
+            too_many = max_entries is not None and len(keep) >= max_entries
+            if too_old or too_many:
+                purged[key] = entry["model_name"]
+            else:
+                keep[key] = entry
+
+        _delete_compiled(list(purged.values()))
+        for key in purged:
+            _loaded_models.pop(key, None)
+            stan_file = os.path.join(CACHE_FOLDER, key + ".stan")
+            if os.path.exists(stan_file):
+                os.remove(stan_file)
+        _write_registry(keep)
+    return list(purged)
+
+def _is_compiled(model_name) -> bool:
+    import httpstan.cache
+    return model_name in httpstan.cache.list_model_names()
+
+def _delete_compiled(model_names):
+    # through the httpstan API, one server for all the models; a model already gone from its cache is not an error
+    if not model_names:
+        return
+    import asyncio
+    import stan
+
+    async def delete():
+        async with stan.common.HttpstanClient() as client:
+            for model_name in model_names:
+                resp = await client.delete("/" + model_name)
+                if resp.status not in (200, 204, 404):
+                    raise RuntimeError(resp.json()["message"])
+
+    asyncio.run(delete())
+
+def _registry_path():
+    return os.path.join(CACHE_FOLDER, REGISTRY_FILE)
+
+def _read_registry():
+    if not os.path.exists(_registry_path()):
+        return {}
+    with open(_registry_path(), "r") as f:
+        return json.load(f)
+
+def _write_registry(registry):
+    atomic_write(_registry_path(), json.dumps(registry, indent = 2))
+
+def _touch_registry_entry(model: CompiledModel):
+    with locked(_registry_path()):
+        registry = _read_registry()
+        now = time.time()
+        entry = registry.get(model.key, {"question": model.question, "model_name": model.model_name, "created": now, "toolchain": toolchain_version()})
+        entry["model_name"] = model.model_name
+        entry["last_used"] = now
+        registry[model.key] = entry
+
+        # keep the normalized program next to the registry, useful when inspecting the cache
+        with open(os.path.join(CACHE_FOLDER, model.key + ".stan"), "w") as f:
+            f.write(model.stan_code)
+        _write_registry(registry)
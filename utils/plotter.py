@@ -14,109 +14,136 @@
 
 from typing import List
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
+import numpy as np
 import os
 import pandas as pd
 
-from model_function import construct_model_function
+from model_function import construct_model_function, evaluate_draws
+from utils.rendering import figure
 
 def plot_data(x: List[float], y: List[float], title="Temperature vs d18_O", x_label= "d18_O_c - d18_O_w", y_label = "Temperature T", file_name = "data.png", folder = "Q1"):
     os.makedirs(os.path.join("plots", folder), exist_ok=True)    
-    plt.figure(figsize=(15, 10))
-    plt.cla()
-    plt.title(title)
-    plt.xlabel(x_label)
-    plt.ylabel(y_label)
-    plt.scatter(x, y)
-    file_name = os.path.join("plots", folder, file_name)
-    plt.savefig(file_name)
-    
+    with figure():
+        plt.title(title)
+        plt.xlabel(x_label)
+        plt.ylabel(y_label)
+        plt.scatter(x, y)
+        file_name = os.path.join("plots", folder, file_name)
+        plt.savefig(file_name)
+
 def plot_predictions(x: List[float], y: List[float], pred: pd.DataFrame, another_pred: pd.DataFrame = None, title="Temperature vs d18_O", x_label= "d18_O_c - d18_O_w", y_label = "Temperature T", file_name = "data.png", folder = "Q1"):
     os.makedirs(os.path.join("plots", folder), exist_ok=True)    
-    plt.figure(figsize=(15, 10))
-    plt.cla()
-    plt.title(title)
-    plt.xlabel(x_label)
-    plt.ylabel(y_label)
-    plt.scatter(x, y)
-    means = pred["mean"].to_list()
-    stds = pred["std"].to_list()
-    plt.errorbar(x, means, yerr=stds, color="red", label="Predicted temperature", fmt=".", capsize=5, capthick=2, ecolor="red", elinewidth=2)
-    
-    if another_pred is not None:
-        plt.errorbar(x + 0.03, another_pred["mean"].to_list(), yerr=another_pred["std"].to_list(), color="green", label="Predicted temperature without considering uncertainty", fmt=".", capsize=5, capthick=2, ecolor="green", elinewidth=2, alpha=0.5)
-    
-    plt.legend()
-    file_name = os.path.join("plots", folder, file_name)
-    plt.savefig(file_name)
-    
-    
-def plot_data_and_fit(x: List[float], y: List[float], fit:pd.DataFrame, model_function, model_name = "Linear regression", title="Temperature vs d18_O", x_label= "d18_O_c - d18_O_w", y_label = "Temperature T", file_name = "data_fit.png", cols = ["a", "b", "sigma"], folder = "Q1"):
+    with figure():
+        plt.title(title)
+        plt.xlabel(x_label)
+        plt.ylabel(y_label)
+        plt.scatter(x, y)
+        means = pred["mean"].to_list()
+        stds = pred["std"].to_list()
+        plt.errorbar(x, means, yerr=stds, color="red", label="Predicted temperature", fmt=".", capsize=5, capthick=2, ecolor="red", elinewidth=2)
+
+        if another_pred is not None:
+            plt.errorbar(x + 0.03, another_pred["mean"].to_list(), yerr=another_pred["std"].to_list(), color="green", label="Predicted temperature without considering uncertainty", fmt=".", capsize=5, capthick=2, ecolor="green", elinewidth=2, alpha=0.5)
+
+        plt.legend()
+        file_name = os.path.join("plots", folder, file_name)
+        plt.savefig(file_name)
+
+
+def plot_data_and_fit(x: List[float], y: List[float], fit:pd.DataFrame, model_function, model_name = "Linear regression", title="Temperature vs d18_O", x_label= "d18_O_c - d18_O_w", y_label = "Temperature T", file_name = "data_fit.png", cols = ["a", "b", "sigma"], folder = "Q1", max_draws = 500, grid_size = 100):
     os.makedirs(os.path.join("plots", folder), exist_ok=True)    
-    plt.figure(figsize=(15, 10))
-    plt.cla()
-    plt.title(title)
-    plt.xlabel(x_label)
-    plt.ylabel(y_label)
-    plt.scatter(x, y)
-    
-    # plotting the mean of the posterior distribution
-    means = fit[cols].mean()
-    stds = fit[cols].std()
-    label = f"{model_name}"
-    for col in cols:
-        label += f", {col}_mean = {means[col]:.2f} (+/- {stds[col]:.2f})"
-                
-    plt.plot(x, model_function(x, means), color="red", label=label)
-    
-    # plotting samples from the posterior distribution to show the uncertainty cloud
-    for index, params in fit[cols].iterrows():
-        plt.plot(x, model_function(x, params), color="green", alpha=0.05)
-    
-    plt.legend()
-    file_name = os.path.join("plots", folder, file_name)
-    plt.savefig(file_name)
-    
-def plot_data_and_fit_no_pooling_and_mix_pooling(x: List[float], y: List[float], fit_no_pooling:pd.DataFrame, fit_mix_pooling: pd.DataFrame, model_function, model_name = "Linear regression", title="Temperature vs d18_O", x_label= "d18_O_c - d18_O_w", y_label = "Temperature T", file_name = "data_fit.png", cols = ["a", "b", "sigma"], folder = "Q1"):
+    with figure():
+        plt.title(title)
+        plt.xlabel(x_label)
+        plt.ylabel(y_label)
+        plt.scatter(x, y)
+        x_grid = get_x_grid(x, grid_size)
+
+        # plotting the mean of the posterior distribution
+        means = fit[cols].mean()
+        stds = fit[cols].std()
+        label = f"{model_name}"
+        for col in cols:
+            label += f", {col}_mean = {means[col]:.2f} (+/- {stds[col]:.2f})"
+
+        plt.plot(x_grid, model_function(x_grid, means), color="red", label=label)
+
+        # plotting samples from the posterior distribution to show the uncertainty cloud
+        plot_draws(x_grid, fit, model_function, cols, color = "green", max_draws = max_draws)
+
+        plt.legend()
+        file_name = os.path.join("plots", folder, file_name)
+        plt.savefig(file_name)
+
+def plot_data_and_fit_no_pooling_and_mix_pooling(x: List[float], y: List[float], fit_no_pooling:pd.DataFrame, fit_mix_pooling: pd.DataFrame, model_function, model_name = "Linear regression", title="Temperature vs d18_O", x_label= "d18_O_c - d18_O_w", y_label = "Temperature T", file_name = "data_fit.png", cols = ["a", "b", "sigma"], folder = "Q1", max_draws = 500, grid_size = 100):
     os.makedirs(os.path.join("plots", folder), exist_ok=True)    
-    plt.figure(figsize=(15, 10))
-    plt.cla()
-    plt.title(title)
-    plt.xlabel(x_label)
-    plt.ylabel(y_label)
-    plt.scatter(x, y)
-    
-    # plotting no pooling
-    
-    # plotting the mean of the posterior distribution    
-    cols_no_pooling = ["a", "b", "sigma"]
-    model_function_no_pooling = construct_model_function(cols_no_pooling)
-    means = fit_no_pooling[cols_no_pooling].mean()
-    stds = fit_no_pooling[cols_no_pooling].std()
-    label = f"{model_name} no pooling"
-    for col in cols_no_pooling:
-        label += f", {col}_mean = {means[col]:.2f} (+/- {stds[col]:.2f})"
-                
-    plt.plot(x, model_function_no_pooling(x, means), color="red", label=label)
-    
-    # plotting samples from the posterior distribution to show the uncertainty cloud
-    for index, params in fit_no_pooling[cols_no_pooling].iterrows():
-        plt.plot(x, model_function_no_pooling(x, params), color="green", alpha=0.05)
-    
-    
-    # plotting mix pooling
-    means = fit_mix_pooling[cols].mean()
-    stds = fit_mix_pooling[cols].std()
-    label = f"{model_name} mix pooling"
-    for col in cols:
-        label += f", {col}_mean = {means[col]:.2f} (+/- {stds[col]:.2f})"
-                
-    plt.plot(x, model_function(x, means), color="blue", label=label)
-    
-    # plotting samples from the posterior distribution to show the uncertainty cloud
-    for index, params in fit_mix_pooling[cols].iterrows():
-        plt.plot(x, model_function(x, params), color="orange", alpha=0.05)
-   
-    
-    plt.legend()
-    file_name = os.path.join("plots", folder, file_name)
-    plt.savefig(file_name)
\ No newline at end of file
+    with figure():
+        plt.title(title)
+        plt.xlabel(x_label)
+        plt.ylabel(y_label)
+        plt.scatter(x, y)
+        x_grid = get_x_grid(x, grid_size)
+
+        # plotting no pooling
+
+        # plotting the mean of the posterior distribution    
+        cols_no_pooling = ["a", "b", "sigma"]
+        model_function_no_pooling = construct_model_function(cols_no_pooling)
+        means = fit_no_pooling[cols_no_pooling].mean()
+        stds = fit_no_pooling[cols_no_pooling].std()
+        label = f"{model_name} no pooling"
+        for col in cols_no_pooling:
+            label += f", {col}_mean = {means[col]:.2f} (+/- {stds[col]:.2f})"
+
+        plt.plot(x_grid, model_function_no_pooling(x_grid, means), color="red", label=label)
+
+        # plotting samples from the posterior distribution to show the uncertainty cloud
+        plot_draws(x_grid, fit_no_pooling, model_function_no_pooling, cols_no_pooling, color = "green", max_draws = max_draws)
+
+
+        # plotting mix pooling
+        means = fit_mix_pooling[cols].mean()
+        stds = fit_mix_pooling[cols].std()
+        label = f"{model_name} mix pooling"
+        for col in cols:
+            label += f", {col}_mean = {means[col]:.2f} (+/- {stds[col]:.2f})"
+
+        plt.plot(x_grid, model_function(x_grid, means), color="blue", label=label)
+
+        # plotting samples from the posterior distribution to show the uncertainty cloud
+        plot_draws(x_grid, fit_mix_pooling, model_function, cols, color = "orange", max_draws = max_draws)
+
+
+        plt.legend()
+        file_name = os.path.join("plots", folder, file_name)
+        plt.savefig(file_name)
+
+def plot_prior_predictive_check(delta: List[float], y_new: List[float], file_name = "prior_predictive_check.png", folder = "Q2"):
+    os.makedirs(os.path.join("plots", folder), exist_ok=True)
+    with figure():
+        plt.scatter(delta, y_new, alpha = 0.3)
+        plt.plot(np.linspace(-4,5,100), [-2] * 100, color = "red", label = "Temperature = -2 C")
+        plt.plot(np.linspace(-4,5,100), [50] * 100, color = "orange", label = "Temperature = 50 C")
+        plt.legend()
+        plt.savefig(os.path.join("plots", folder, file_name))
+
+def get_x_grid(x, grid_size = 100):
+    # sorted evaluation points spanning the data, the fitted lines do not need one point per observation
+    x = np.asarray(x, dtype = float)
+    return np.linspace(x.min(), x.max(), grid_size)
+
+def thin_draws(fit: pd.DataFrame, max_draws = 500) -> pd.DataFrame:
+    # evenly spaced draws, so every chain stays represented
+    if max_draws is None or len(fit) <= max_draws:
+        return fit
+    return fit.iloc[np.linspace(0, len(fit) - 1, max_draws).astype(int)]
+
+def plot_draws(x_grid, fit: pd.DataFrame, model_function, cols, color = "green", alpha = 0.05, max_draws = 500):
+    # all draw lines are evaluated as one draws x grid matrix and drawn as a single rasterized collection
+    lines = evaluate_draws(model_function, x_grid, thin_draws(fit[cols], max_draws), cols = cols, dtype = np.float32)
+    segments = np.stack((np.broadcast_to(x_grid, lines.shape), lines), axis = -1)
+    
+    ax = plt.gca()
+    ax.add_collection(LineCollection(segments, colors = color, alpha = alpha, rasterized = True))
+    ax.autoscale_view()
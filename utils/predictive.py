@@ -0,0 +1,138 @@
+# Copyright 2022 Cristian Grosu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pandas as pd
+
+from model_function import construct_model_function, evaluate_draws
+from utils.streaming import QuantileSketch, RunningMoments
+
+def simulate_predictive(delta, a_mean, a_std, b_mean, b_std, sigma, num_param_draws = 50, num_noise_draws = 1000, memory_budget_mb = 256, rng = None) -> pd.DataFrame:
+    # simulates T = a + b * delta + eps for every observation as a (observations x parameter draws x noise draws) tensor
+    delta = np.asarray(delta, dtype = float)
+    rng = np.random.default_rng() if rng is None else rng
+
+    # the noise tensor and the broadcasted location are alive at the same time
+    bytes_per_observation = 2 * num_param_draws * num_noise_draws * np.dtype(float).itemsize
+    chunk_size = max(1, int(memory_budget_mb * 2**20 // bytes_per_observation))
+
+    means = np.empty(len(delta))
+    stds = np.empty(len(delta))
+    for start in range(0, len(delta), chunk_size):
+        delta_chunk = delta[start:start + chunk_size, None, None]
+        a = rng.normal(a_mean, a_std, size = (len(delta_chunk), num_param_draws, 1))
+        b = rng.normal(b_mean, b_std, size = (len(delta_chunk), num_param_draws, 1))
+        y_pred = rng.normal(a + b * delta_chunk, sigma, size = (len(delta_chunk), num_param_draws, num_noise_draws))
+
+        means[start:start + chunk_size] = y_pred.mean(axis = (1, 2))
+        stds[start:start + chunk_size] = y_pred.std(axis = (1, 2))
+
+    return pd.DataFrame({"mean": means, "std": stds}, index = [f"y_{i}" for i in range(len(delta))])
+
+def simulate_predictive_with_measurement_error(d18_O_c, d18_O_w, d18_O_c_sd, d18_O_w_sd, a_mean, a_std, b_mean, b_std, sigma, num_param_draws = 50, num_measurement_draws = 50, num_noise_draws = 100, block_size = 2**21, quantiles = None, rng = None) -> pd.DataFrame:
+    # same simulation as simulate_predictive but the measured d18_O values are redrawn from their measurement error;
+    # the draws are generated as (observations x parameter draws x measurement draws x noise draws) blocks of at most
+    # block_size values and folded into running moments instead of being stored. Observations whose draws fit in one
+    # block get exact quantiles, otherwise their parameter draws are split over blocks and the quantiles are sketched
+    rng = np.random.default_rng() if rng is None else rng
+    d18_O_c, d18_O_w = np.asarray(d18_O_c, dtype = float), np.asarray(d18_O_w, dtype = float)
+    d18_O_c_sd, d18_O_w_sd = np.broadcast_to(d18_O_c_sd, d18_O_c.shape), np.broadcast_to(d18_O_w_sd, d18_O_w.shape)
+
+    draws_per_param = num_measurement_draws * num_noise_draws
+    obs_per_block = max(1, block_size // (num_param_draws * draws_per_param))
+    params_per_block = min(num_param_draws, max(1, block_size // (obs_per_block * draws_per_param)))
+    sketched = quantiles is not None and params_per_block < num_param_draws
+
+    means, stds = np.empty(len(d18_O_c)), np.empty(len(d18_O_c))
+    quantile_values = np.empty((len(d18_O_c), len(quantiles))) if quantiles is not None else None
+    for obs_start in range(0, len(d18_O_c), obs_per_block):
+        obs = slice(obs_start, min(obs_start + obs_per_block, len(d18_O_c)))
+        num_obs = obs.stop - obs.start
+        moments = RunningMoments(shape = (num_obs,))
+        sketches = [QuantileSketch(rng = rng) for _ in range(num_obs)] if sketched else None
+
+        for start in range(0, num_param_draws, params_per_block):
+            size = min(params_per_block, num_param_draws - start)
+            a = rng.normal(a_mean, a_std, size = (num_obs, size, 1, 1))
+            b = rng.normal(b_mean, b_std, size = (num_obs, size, 1, 1))
+            d18_O_c_block = rng.normal(d18_O_c[obs, None, None, None], d18_O_c_sd[obs, None, None, None], size = (num_obs, size, num_measurement_draws, 1))
+            d18_O_w_block = rng.normal(d18_O_w[obs, None, None, None], d18_O_w_sd[obs, None, None, None], size = (num_obs, size, num_measurement_draws, 1))
+            y_pred = rng.normal(a + b * (d18_O_c_block - d18_O_w_block), sigma, size = (num_obs, size, num_measurement_draws, num_noise_draws))
+
+            moments.update(y_pred)
+            if sketched:
+                for sketch, values in zip(sketches, y_pred):
+                    sketch.update(values)
+            elif quantiles is not None:
+                quantile_values[obs] = np.quantile(y_pred.reshape(num_obs, -1), quantiles, axis = 1).T
+
+        means[obs], stds[obs] = moments.mean, moments.std
+        if sketched:
+            quantile_values[obs] = [sketch.quantiles(quantiles) for sketch in sketches]
+
+    df = pd.DataFrame({"mean": means, "std": stds}, index = [f"y_{i}" for i in range(len(d18_O_c))])
+    if quantiles is not None:
+        for q, values in zip(quantiles, quantile_values.T):
+            df[f"{100 * q:g}%"] = values
+    return df
+
+def analytic_predictive(d18_O_c, d18_O_w, d18_O_c_sd, d18_O_w_sd, a_mean, a_std, b_mean, b_std, sigma) -> pd.DataFrame:
+    # exact first two moments of T = a + b * (d18_O_c - d18_O_w) + eps with independent gaussian a, b, eps and measurement errors
+    delta_mean = np.asarray(d18_O_c, dtype = float) - np.asarray(d18_O_w, dtype = float)
+    delta_var = np.broadcast_to(np.asarray(d18_O_c_sd, dtype = float) ** 2 + np.asarray(d18_O_w_sd, dtype = float) ** 2, delta_mean.shape)
+
+    # Var(b * delta) = Var(b) Var(delta) + Var(b) E[delta]^2 + E[b]^2 Var(delta)
+    means = a_mean + b_mean * delta_mean
+    variances = a_std ** 2 + b_std ** 2 * (delta_var + delta_mean ** 2) + b_mean ** 2 * delta_var + sigma ** 2
+
+    return pd.DataFrame({"mean": means, "std": np.sqrt(variances)}, index = [f"y_{i}" for i in range(len(delta_mean))])
+
+def check_predictive(analytic: pd.DataFrame, simulated: pd.DataFrame, num_param_draws = 50, z = 4.0) -> pd.DataFrame:
+    # differences of the simulated moments to the exact ones in units of the predictive std; the Monte Carlo error of both
+    # moments is dominated by the parameter draws, so a difference is accepted up to z standard errors of std / sqrt(num_param_draws)
+    tolerance = z / np.sqrt(num_param_draws)
+    check = pd.DataFrame(index = analytic.index)
+    check["mean_error"] = (simulated["mean"] - analytic["mean"]).abs() / analytic["std"]
+    check["std_error"] = (simulated["std"] - analytic["std"]).abs() / analytic["std"]
+    check["ok"] = (check["mean_error"] <= tolerance) & (check["std_error"] <= tolerance)
+    return check
+
+def posterior_predictive_draws(draws: pd.DataFrame, d18_O_c, d18_O_w, group, d18_O_c_sd = 0, d18_O_w_sd = 0, rng = None) -> np.ndarray:
+    # draws x observations matrix of predicted temperatures from the posterior draws of the hierarchical model,
+    # `group` holds the 1-based species index of every observation, 0 stands for a species not seen while fitting
+    rng = np.random.default_rng() if rng is None else rng
+    group = np.asarray(group, dtype = int)
+    delta = np.asarray(d18_O_c, dtype = float) - np.asarray(d18_O_w, dtype = float)
+    delta_sd = np.sqrt(np.broadcast_to(np.asarray(d18_O_c_sd, dtype = float) ** 2 + np.asarray(d18_O_w_sd, dtype = float) ** 2, delta.shape))
+
+    num_species = sum(1 for col in draws.columns if col.startswith("a."))
+    a = draws[[f"a.{j}" for j in range(1, num_species + 1)]].to_numpy()
+    b = draws[[f"b.{j}" for j in range(1, num_species + 1)]].to_numpy()
+    sigma = draws["sigma"].to_numpy()
+
+    # column 0 holds the coefficients of a new species drawn from the population distribution
+    if np.any(group == 0):
+        a_new = rng.normal(draws["A"].to_numpy(), draws["sigma_a"].to_numpy())
+        b_new = rng.normal(draws["B"].to_numpy(), draws["sigma_b"].to_numpy())
+    else:
+        a_new = b_new = np.zeros(len(draws))
+    a = np.column_stack((a_new, a))
+    b = np.column_stack((b_new, b))
+
+    num_draws = len(draws)
+    delta = delta[None, :] + delta_sd[None, :] * rng.standard_normal((num_draws, len(delta)))
+    return evaluate_draws(construct_model_function(), delta, {"a": a[:, group], "b": b[:, group]}) + sigma[:, None] * rng.standard_normal((num_draws, len(group)))
+
+def summarize_predictive_draws(y_pred) -> pd.DataFrame:
+    return pd.DataFrame({"mean": y_pred.mean(axis = 0), "std": y_pred.std(axis = 0)}, index = [f"y_{i}" for i in range(y_pred.shape[1])])
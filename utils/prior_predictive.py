@@ -0,0 +1,106 @@
+# Copyright 2022 Cristian Grosu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+
+import numpy as np
+import pandas as pd
+
+from utils.stan_models import get_stan_code
+
+# distributions a prior can be sampled from, by their Stan name
+DISTRIBUTIONS = {
+    "uniform": lambda rng, lower, upper, size: rng.uniform(lower, upper, size),
+    "normal": lambda rng, mu, sd, size: rng.normal(mu, sd, size),
+}
+
+# sigma of Q2 only has a lower bound and no prior statement, an improper prior cannot be sampled:
+# uniform up to 10 degrees, well above the residual sd of the Q1 fit (about 2.5)
+EXTRA_PRIORS = {
+    "Q2": {"sigma": ("uniform", 1, 10)},
+}
+
+def parse_bounds(stan_code):
+    # {name: (lower, upper)} of the scalar parameters, missing bounds are infinite
+    bounds = {}
+    for constraint, name in re.findall(r"\breal\s*(?:<([^>]*)>)?\s+(\w+)\s*;", _block(stan_code, "parameters")):
+        limits = dict(re.findall(r"(lower|upper)\s*=\s*([-+.\deE]+)", constraint))
+        bounds[name] = (float(limits.get("lower", -np.inf)), float(limits.get("upper", np.inf)))
+    return bounds
+
+def parse_priors(stan_code):
+    # {name: (distribution, *arguments, bounds)} of the scalar parameters, from the model block statements with numeric
+    # arguments ("a ~ uniform(-2, 50);"); a parameter without such a statement but with both bounds gets a uniform prior
+    # over them. Draws outside the bounds of a parameter are redrawn, as Stan truncates its prior
+    bounds = parse_bounds(stan_code)
+    priors = {}
+    for statement in _block(stan_code, "model").split(";"):
+        match = re.fullmatch(r"\s*(\w+)\s*~\s*(\w+)\s*\(([^)]*)\)\s*", statement)
+        if match is None or match.group(1) not in bounds or match.group(2) not in DISTRIBUTIONS:
+            continue
+        try:
+            arguments = tuple(float(argument) for argument in match.group(3).split(","))
+        except ValueError:
+            # a prior on other parameters (a hierarchy) cannot be sampled on its own
+            continue
+        priors[match.group(1)] = (match.group(2), *arguments)
+
+    for name, (lower, upper) in bounds.items():
+        if name not in priors and np.isfinite(lower) and np.isfinite(upper):
+            priors[name] = ("uniform", lower, upper)
+    return {name: prior + (bounds[name],) for name, prior in priors.items()}
+
+def get_priors(question = "Q2"):
+    # the priors of the program completed by the ones it leaves improper
+    stan_code = get_stan_code(question = question)
+    priors, bounds = parse_priors(stan_code), parse_bounds(stan_code)
+    for name, prior in EXTRA_PRIORS.get(question, {}).items():
+        priors[name] = prior + (bounds.get(name, (-np.inf, np.inf)),)
+    return priors
+
+def sample_priors(priors, num_draws = 4000, rng = None) -> pd.DataFrame:
+    rng = np.random.default_rng(rng)
+    draws = {}
+    for name, (distribution, *arguments, (lower, upper)) in priors.items():
+        values = DISTRIBUTIONS[distribution](rng, *arguments, num_draws)
+        outside = (values < lower) | (values > upper)
+        while outside.any():
+            values[outside] = DISTRIBUTIONS[distribution](rng, *arguments, int(outside.sum()))
+            outside = (values < lower) | (values > upper)
+        draws[name] = values
+    return pd.DataFrame(draws)
+
+def prior_predictive(priors, num_draws = 4000, x = None, x_range = (-4, 5), rng = None) -> pd.DataFrame:
+    # one simulated temperature y_new = a + b * delta + noise per prior draw, delta is uniform over x_range
+    # or, when x is given, a random observed difference of d18_O values
+    rng = np.random.default_rng(rng)
+    df = sample_priors(priors, num_draws = num_draws, rng = rng)
+    if x is None:
+        df["delta"] = rng.uniform(x_range[0], x_range[1], num_draws)
+    else:
+        df["delta"] = rng.choice(np.asarray(x, dtype = float), num_draws)
+    df["y_new"] = rng.normal(df["a"] + df["b"] * df["delta"], df["sigma"])
+    return df
+
+def _block(stan_code, name):
+    # body of a top level block, the braces of nested loops are balanced
+    match = re.search(r"(?:^|\n)\s*" + name + r"\s*\{", stan_code)
+    if match is None:
+        return ""
+    depth, start = 1, match.end()
+    for i in range(start, len(stan_code)):
+        depth += {"{": 1, "}": -1}.get(stan_code[i], 0)
+        if depth == 0:
+            return stan_code[start:i]
+    return stan_code[start:]
@@ -0,0 +1,86 @@
+# Copyright 2022 Cristian Grosu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+from scipy.special import logsumexp
+
+# Pareto smoothed importance sampling leave one out cross validation (Vehtari, Gelman and Gabry, 2017),
+# every function takes a draws x observations log likelihood matrix and works on all observations at once
+
+# above this Pareto k the importance sampling estimate of an observation is not reliable
+K_THRESHOLD = 0.7
+
+def psis_loo(log_lik, block_size = 256):
+    # pointwise elpd_loo and Pareto k of every observation, in blocks of observations to bound the memory of the GPD fit
+    log_lik = np.asarray(log_lik, dtype = float)
+    elpd = np.empty(log_lik.shape[1])
+    k = np.empty(log_lik.shape[1])
+    for start in range(0, log_lik.shape[1], block_size):
+        block = log_lik[:, start:start + block_size]
+        log_weights, k[start:start + block_size] = psis_smooth(-block)
+        elpd[start:start + block_size] = logsumexp(log_weights + block, axis = 0)
+    return elpd, k
+
+def psis_smooth(log_ratios):
+    # normalized log weights with the largest ratios of every column replaced by the expected order statistics
+    # of the generalized Pareto distribution fitted to them, and the shape k of that distribution
+    num_draws, num_obs = log_ratios.shape
+    tail_size = int(min(np.ceil(0.2 * num_draws), np.ceil(3 * np.sqrt(num_draws))))
+    log_weights = log_ratios - log_ratios.max(axis = 0)
+    if tail_size < 5:
+        return log_weights - logsumexp(log_weights, axis = 0), np.full(num_obs, np.inf)
+
+    order = np.argsort(log_weights, axis = 0)
+    tail_order = order[-tail_size:]
+    tail = np.take_along_axis(log_weights, tail_order, axis = 0)
+    cutoff = np.exp(np.take_along_axis(log_weights, order[-tail_size - 1:-tail_size], axis = 0))
+    k, sigma = gpd_fit(np.exp(tail) - cutoff)
+
+    # expected order statistics of the fitted tail, truncated at the largest raw weight (0 after the shift)
+    p = ((np.arange(tail_size) + 0.5) / tail_size)[:, None]
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        quantiles = cutoff + sigma * np.expm1(-k * np.log1p(-p)) / k
+        smoothed = np.minimum(np.log(quantiles), 0)
+    # a tail that could not be fitted keeps its raw weights
+    smoothed = np.where(np.isfinite(smoothed), smoothed, tail)
+    np.put_along_axis(log_weights, tail_order, smoothed, axis = 0)
+    return log_weights - logsumexp(log_weights, axis = 0), k
+
+def gpd_fit(x, prior = 3.0):
+    # Zhang and Stephens (2009) estimate of the generalized Pareto shape k and scale sigma of every column of x,
+    # the sorted exceedances over the threshold; k is shrunk towards 0.5 as in the loo package
+    n = x.shape[0]
+    m = 30 + int(np.sqrt(n))
+    j = np.arange(1, m + 1)[:, None]
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        theta = 1 / x[-1] + (1 - np.sqrt(m / (j - 0.5))) / (prior * x[int(n / 4 + 0.5) - 1])
+        # profile log likelihood of every candidate theta, m x columns
+        k = np.mean(np.log1p(-theta[:, None, :] * x[None]), axis = 1)
+        profile = n * (np.log(-theta / k) - k - 1)
+        weights = np.exp(profile - logsumexp(profile, axis = 0))
+        theta_hat = np.sum(theta * weights, axis = 0)
+        k_hat = np.mean(np.log1p(-theta_hat * x), axis = 0)
+        sigma = -k_hat / theta_hat
+    k_hat = (n * k_hat + 10 * 0.5) / (n + 10)
+    # columns without distinct exceedances have no tail estimate
+    return np.where(np.isfinite(k_hat), k_hat, np.inf), sigma
+
+def elpd_kfold(log_lik, holdout):
+    # pointwise elpd of the held out observations of every fold: log_lik is a list of draws x observations matrices,
+    # one per fold, and holdout the matching boolean masks that together cover every observation once
+    elpd = np.full(len(holdout[0]), np.nan)
+    for fold_log_lik, mask in zip(log_lik, holdout):
+        fold_log_lik = np.asarray(fold_log_lik, dtype = float)[:, mask]
+        elpd[mask] = logsumexp(fold_log_lik, axis = 0) - np.log(fold_log_lik.shape[0])
+    return elpd
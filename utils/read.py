@@ -12,14 +12,26 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import pandas as pd
+import json
+import os
+from typing import Dict
 
-def read_data(filename, cols = None) -> pd.DataFrame:
-    df = pd.read_csv(filename)
-    if cols is not None:
-        return df[cols]
-    return df
+import numpy as np
+import pandas as pd
 
 def read_stan_results(filename = "results.csv") -> pd.DataFrame:
     df = pd.read_csv(filename, delimiter=",")
-    return df
\ No newline at end of file
+    return df
+
+def open_draws(store, cols = None, mmap = True) -> Dict[str, np.ndarray]:
+    # (chains, draws) arrays of the requested parameters, memory mapped unless mmap is False
+    with open(os.path.join(store, "meta.json"), "r") as f:
+        meta = json.load(f)
+    if cols is None:
+        cols = meta["params"]
+    return {col: np.load(os.path.join(store, col + ".npy"), mmap_mode = "r" if mmap else None) for col in cols}
+
+def read_draws(store, cols = None) -> pd.DataFrame:
+    # same layout as fit.to_frame(): draw after draw, chains interleaved
+    draws = open_draws(store, cols = cols)
+    return pd.DataFrame({col: values.T.reshape(-1) for col, values in draws.items()})
@@ -0,0 +1,76 @@
+# Copyright 2022 Cristian Grosu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+import os
+
+import matplotlib
+
+# plots are only ever written to files, an interactive backend would keep every figure alive
+matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt
+
+@contextmanager
+def figure(figsize = (15, 10)):
+    # the figure is closed as soon as the plot is saved, even when plotting fails
+    fig = plt.figure(figsize = figsize)
+    try:
+        yield fig
+    finally:
+        plt.close(fig)
+
+class PlotQueue:
+    # renders plot jobs in worker processes while the caller keeps sampling, the jobs get the data they plot as arguments
+    # so they must be picklable (plotter functions, numpy arrays, data frames, functools.partial model functions);
+    # with workers = 0 every job is rendered right away in the calling process
+    def __init__(self, workers = None):
+        if workers is None:
+            workers = min(2, os.cpu_count() or 1)
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(max_workers = workers) if workers > 0 else None
+        self.futures = []
+
+    def submit(self, function, *args, **kwargs):
+        if self.executor is None:
+            function(*args, **kwargs)
+        else:
+            self.futures.append(self.executor.submit(function, *args, **kwargs))
+
+    def wait(self):
+        # blocks until every queued plot is written, the first failure is raised once all jobs are done
+        errors = []
+        for future in self.futures:
+            try:
+                future.result()
+            except Exception as e:
+                errors.append(e)
+        self.futures = []
+        if errors:
+            raise errors[0]
+
+    def close(self):
+        try:
+            self.wait()
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
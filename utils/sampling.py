@@ -0,0 +1,103 @@
+# Copyright 2022 Cristian Grosu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import dataclasses
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.conjugate import SampledFit
+from utils.diagnostics import summarize
+
+# default stopping rule: every monitored parameter converged with at least 400 effective draws in the bulk and the tails
+TARGETS = {"r_hat": 1.01, "ess_bulk": 400, "ess_tail": 400}
+
+def sample_until_converged(posterior, num_chains = 4, increment = 250, params = None, targets = None, continuation_warmup = 100, max_draws = 4000, max_seconds = None, verbose = True):
+    # samples `increment` draws per chain at a time until the monitored parameters (all but the __ columns by default)
+    # meet the R-hat and effective sample size targets, or until max_draws per chain or max_seconds are spent;
+    # the fit carries the summary of the last increment, so the draws are not summarized again.
+    # A fit cannot be resumed, so every increment restarts the chains from their last draws with a short warmup
+    # (continuation_warmup); Stan also gets the adapted step size and windows that fit the short warmup to re-adapt the metric
+    targets = dict(TARGETS, **(targets or {}))
+    start = time.perf_counter()
+    blocks = []
+    columns = None
+    stepsize = None
+    summary = None
+    seed = getattr(posterior, "random_seed", None)
+    current = posterior
+
+    while True:
+        kwargs = {}
+        if blocks:
+            kwargs = {"init": _last_draws(blocks[-1], columns), "num_warmup": continuation_warmup}
+            if stepsize is not None:
+                kwargs["stepsize"] = stepsize
+                if continuation_warmup > 0:
+                    # the default adaptation windows need 150 warmup iterations
+                    kwargs.update({"init_buffer": continuation_warmup // 4, "window": continuation_warmup // 2, "term_buffer": continuation_warmup // 4})
+            if seed is not None and dataclasses.is_dataclass(posterior):
+                # every increment needs fresh random numbers, a built Stan program is frozen with its seed
+                current = dataclasses.replace(posterior, random_seed = seed + len(blocks))
+
+        num_samples = min(increment, max_draws - sum(block.shape[1] for block in blocks))
+        df = current.sample(num_chains = num_chains, num_samples = num_samples, **kwargs).to_frame()
+        columns = list(df.columns)
+        # to_frame() interleaves the chains, block is chains x draws x columns
+        blocks.append(df.to_numpy().reshape(num_samples, num_chains, len(columns)).transpose(1, 0, 2))
+        if "stepsize__" in columns:
+            stepsize = float(np.median(blocks[-1][:, -1, columns.index("stepsize__")]))
+
+        draws = np.concatenate(blocks, axis = 1)
+        names = [col for col in columns if not col.endswith("__")]
+        summary = summarize(draws[:, :, [columns.index(col) for col in names]], names = names)
+        diagnostics = summary.loc[params if params is not None else names]
+        converged = (diagnostics["r_hat"] <= targets["r_hat"]).all() and (diagnostics["ess_bulk"] >= targets["ess_bulk"]).all() and (diagnostics["ess_tail"] >= targets["ess_tail"]).all()
+        elapsed = time.perf_counter() - start
+        if verbose:
+            print(f"{draws.shape[1]} draws per chain: max R-hat {diagnostics['r_hat'].max():.3f}, min bulk ESS {diagnostics['ess_bulk'].min():.0f}, min tail ESS {diagnostics['ess_tail'].min():.0f} ({elapsed:.1f}s)")
+
+        if converged or draws.shape[1] >= max_draws or (max_seconds is not None and elapsed >= max_seconds):
+            break
+
+    df = pd.DataFrame(draws.transpose(1, 0, 2).reshape(-1, len(columns)), columns = columns)
+    df.index.name, df.columns.name = "draws", "parameters"
+    fit = SampledFit(df, num_chains)
+    fit.summary = summary
+    fit.converged = converged
+    return fit
+
+def _last_draws(block, columns):
+    # last draw of every chain as Stan init values, "a.2" goes back to the second entry of the vector a
+    inits = []
+    for chain in range(block.shape[0]):
+        values = {}
+        for col, value in zip(columns, block[chain, -1]):
+            if col.endswith("__"):
+                continue
+            name, *index = col.split(".")
+            values.setdefault(name, {})[tuple(int(i) - 1 for i in index)] = value
+        init = {}
+        for name, entries in values.items():
+            if () in entries:
+                init[name] = entries[()]
+                continue
+            shape = tuple(max(index[axis] for index in entries) + 1 for axis in range(len(next(iter(entries)))))
+            array = np.zeros(shape)
+            for index, value in entries.items():
+                array[index] = value
+            init[name] = array.tolist()
+        inits.append(init)
+    return inits
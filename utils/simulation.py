@@ -0,0 +1,53 @@
+# Copyright 2022 Cristian Grosu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import os
+
+import numpy as np
+import pandas as pd
+
+def parallel_simulate(simulate, observations, seed = None, chunk_size = 16, workers = None, use_threads = False, **kwargs) -> pd.DataFrame:
+    # runs simulate(**chunk of observations, rng = ..., **kwargs) over fixed chunks of the per observation arrays;
+    # every chunk draws from its own stream spawned from the seed, so the output only depends on the seed and chunk_size,
+    # not on the number of workers or on the order in which chunks finish
+    observations = {name: np.asarray(values) for name, values in observations.items()}
+    num_observations = len(next(iter(observations.values())))
+    starts = list(range(0, num_observations, chunk_size))
+    streams = np.random.SeedSequence(seed).spawn(len(starts))
+    jobs = [({name: values[start:start + chunk_size] for name, values in observations.items()}, stream) for start, stream in zip(starts, streams)]
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(jobs))
+    if workers <= 1:
+        chunks = [_simulate_chunk(simulate, chunk, stream, kwargs) for chunk, stream in jobs]
+    else:
+        pool = ThreadPoolExecutor if use_threads else ProcessPoolExecutor
+        with pool(max_workers = workers) as executor:
+            chunks = list(executor.map(_simulate_chunk, *zip(*[(simulate, chunk, stream, kwargs) for chunk, stream in jobs])))
+
+    if not chunks:
+        return pd.DataFrame(columns = ["mean", "std"])
+    df = pd.concat(chunks)
+    df.index = [f"y_{i}" for i in range(num_observations)]
+    return df
+
+def spawn_seeds(seed, num_seeds):
+    # independent integer seeds of separate fits, spawned from the seed; 31 bits so that a Stan random_seed
+    # stays valid when an incremental sampler adds the number of increments to it
+    return [int(stream.generate_state(1)[0] >> 1) for stream in np.random.SeedSequence(seed).spawn(num_seeds)]
+
+def _simulate_chunk(simulate, chunk, stream, kwargs):
+    return simulate(**chunk, rng = np.random.default_rng(stream), **kwargs)
@@ -12,14 +12,17 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+# the programs with a species level hierarchy, and the parameterizations they are available in
+HIERARCHICAL_QUESTIONS = ["Q3_B", "Q4_A", "Q4_B"]
+PARAMETERIZATIONS = ["centered", "vectorized", "non_centered"]
 
-def get_stan_code(question = "Q1"):
+def get_stan_code(question = "Q1", parameterization = "centered"):
     stan_code_q1 = """
         data {
             int<lower=0> N;
-            real d18_O_w[N];
-            real d18_O_c[N];
-            real y[N]; // temperature
+            array[N] real d18_O_w;
+            array[N] real d18_O_c;
+            array[N] real y; // temperature
         }
         
         parameters {
@@ -37,13 +40,13 @@ def get_stan_code(question = "Q1"):
     stan_code_q2 = """
         data {
             int<lower=0> N;
-            real d18_O_w[N];
-            real d18_O_c[N];
-            real<lower=-2, upper=50> y[N]; // temperature
+            array[N] real d18_O_w;
+            array[N] real d18_O_c;
+            array[N] real<lower=-2, upper=50> y; // temperature
         }
         
         transformed data {
-            real<lower=-4, upper=5> diff[N];  
+            array[N] real<lower=-4, upper=5> diff;  
             for (i in 1:N)
                 diff[i] = d18_O_c[i] - d18_O_w[i];        // difference between the two d18_O values
         }
@@ -61,29 +64,15 @@ def get_stan_code(question = "Q1"):
              
             for (i in 1:N)
                 y[i] ~ normal(a + b * diff[i], sigma);                    
-        }        
-        
-        generated quantities {
-            real y_new;
-            real<lower=-4, upper=5> diff;
-            real a_new;
-            real b_new;
-            real sigma_new;
-             
-            diff = uniform_rng(-4, 5);    
-            a_new = uniform_rng(-2, 50);
-            b_new = normal_rng(0, 1);
-              
-            y_new = normal_rng(a_new + b_new * diff, sigma);
         }
     """
     
     stan_code_q3 = """
     data {            
             int<lower=0> N; // number of observations
-            real d18_O_w[N]; // d18_O of water
-            real d18_O_c[N]; // d18_O of carbon
-            real<lower=-2, upper=50> y[N]; // temperature
+            array[N] real d18_O_w; // d18_O of water
+            array[N] real d18_O_c; // d18_O of carbon
+            array[N] real<lower=-2, upper=50> y; // temperature
         }
         
         parameters {
@@ -102,7 +91,7 @@ def get_stan_code(question = "Q1"):
         data {            
             int<lower=0> J; // number of groups
             int<lower=0> N; // number of observations
-            int group[N]; // group indicator
+            array[N] int group; // group indicator
             vector[N] d18_O_w; // matrix of d18_O of water
             vector[N] d18_O_c; // matrix of d18_O of carbon
             vector[N] T; // temperature                
@@ -136,7 +125,7 @@ def get_stan_code(question = "Q1"):
         data {            
             int<lower=0> J; // number of groups
             int<lower=0> N; // number of observations
-            int group[N]; // group indicator
+            array[N] int group; // group indicator
             vector[N] d18_O_w; // matrix of d18_O of water
             vector[N] d18_O_c; // matrix of d18_O of carbon
             vector[N] T; // temperature                
@@ -173,7 +162,7 @@ def get_stan_code(question = "Q1"):
         generated quantities {
             vector[K] y_new;
             for (k in 1:K){
-                y_new[k] = normal_rng(a[specie] + b[specie] * (d18_O_c[k] - d18_O_w[k]), sigma);
+                y_new[k] = normal_rng(a[specie] + b[specie] * (d18_O_c_new[k] - d18_O_w_new[k]), sigma);
             }        
         }
     """
@@ -182,7 +171,7 @@ def get_stan_code(question = "Q1"):
         data {            
             int<lower=0> J; // number of groups
             int<lower=0> N; // number of observations
-            int group[N]; // group indicator
+            array[N] int group; // group indicator
             vector[N] d18_O_w; // matrix of d18_O of water
             vector[N] d18_O_c; // matrix of d18_O of carbon
             vector[N] T; // temperature                
@@ -221,8 +210,8 @@ def get_stan_code(question = "Q1"):
         
         generated quantities {
             vector[K] y_new;
-            real d18_O_c_s[K];
-            real d18_O_w_s[K]; 
+            array[K] real d18_O_c_s;
+            array[K] real d18_O_w_s; 
         
             for (k in 1:K){
                 d18_O_c_s[k] = normal_rng(d18_O_c_new[k], d18_O_c_std);
@@ -234,6 +223,208 @@ def get_stan_code(question = "Q1"):
     """
     
     
+    # collapsed likelihoods: the data are the sufficient statistics of y ~ normal(a + b * x, sigma), x = d18_O_c - d18_O_w,
+    # so the cost of a gradient evaluation does not depend on the number of observations
+    stan_code_collapsed = """
+        data {
+            real<lower=0> n; // number of observations
+            real sx; // sum of x
+            real sxx; // sum of x^2
+            real sy; // sum of temperatures
+            real sxy; // sum of x * y
+            real syy; // sum of y^2
+        }
+        
+        parameters {
+            real a;
+            real b;
+            real<lower=0> sigma;
+        }
+        
+        model {
+            target += -n * log(sigma) - (syy - 2 * a * sy - 2 * b * sxy + n * square(a) + 2 * a * b * sx + square(b) * sxx) / (2 * square(sigma));
+        }
+    """
+    
+    stan_code_q3_mix_pooling_collapsed = """
+        data {
+            int<lower=0> J; // number of groups
+            vector<lower=0>[J] n; // number of observations per group
+            vector[J] sx; // per group sum of x
+            vector[J] sxx; // per group sum of x^2
+            vector[J] sy; // per group sum of temperatures
+            vector[J] sxy; // per group sum of x * y
+            vector[J] syy; // per group sum of y^2
+        }
+        
+        parameters {
+            real A; // intercept
+            real B; // slope
+            vector[J] a; // intercept
+            vector[J] b; // slope
+            real<lower=0> sigma; // standard deviation
+            real<lower=0> sigma_a; // intercept_std
+            real<lower=0> sigma_b; // slope_std
+        }
+        
+        model {
+            A ~ uniform(-2, 50);
+            B ~ normal(0, 1);
+            sigma_a ~ normal(1, 1);
+            sigma_b ~ normal(0.5, 0.5);
+            a ~ normal(A, sigma_a);
+            b ~ normal(B, sigma_b);
+            
+            target += -sum(n) * log(sigma) - sum(syy - 2 * a .* sy - 2 * b .* sxy + n .* square(a) + 2 * a .* b .* sx + square(b) .* sxx) / (2 * square(sigma));
+        }
+    """
+    
+    # cross validation versions of the Q3_A and Q3_B models: the observations with holdout = 1 are left out of the likelihood
+    # and the pointwise log likelihood of all observations is generated, with no holdout the fit gives the PSIS-LOO inputs
+    holdout_data = """
+            array[N] int<lower=0, upper=1> holdout; // 1 for the observations left out of the fit"""
+    
+    train_index = """
+            int N_train = N - sum(holdout); // number of observations the model is fitted on
+            array[N_train] int train; // their indices
+            {
+                int k = 1;
+                for (i in 1:N) {
+                    if (holdout[i] == 0) {
+                        train[k] = i;
+                        k += 1;
+                    }
+                }
+            }"""
+    
+    log_lik_hierarchical = """
+        generated quantities {
+            vector[N] log_lik;
+            for (i in 1:N)
+                log_lik[i] = normal_lpdf(T[i] | a[group[i]] + b[group[i]] * diff[i], sigma);
+        }
+    """
+    
+    stan_code_q3_cv = """
+        data {
+            int<lower=0> N; // number of observations
+            vector[N] d18_O_w; // d18_O of water
+            vector[N] d18_O_c; // d18_O of carbon
+            vector[N] y; // temperature
+            """ + holdout_data + """
+        }
+        
+        transformed data {
+            vector[N] diff = d18_O_c - d18_O_w;""" + train_index + """
+        }
+        
+        parameters {
+            real a; // intercept
+            real b; // slope
+            real<lower=0> sigma; // standard deviation
+        }
+        
+        model {
+            y[train] ~ normal(a + b * diff[train], sigma);
+        }
+        
+        generated quantities {
+            vector[N] log_lik;
+            for (i in 1:N)
+                log_lik[i] = normal_lpdf(y[i] | a + b * diff[i], sigma);
+        }
+    """
+    
+    # the hierarchical model of Q3_B (and Q4) in two more parameterizations with the same posterior: the bounds of A and
+    # sigma match their priors instead of being rejected by the sampler, and the likelihood is one vectorized statement
+    # over the differences computed once in transformed data; the non centered version samples standard normal offsets
+    # of a and b, which mixes better when the data say little about the species level spread
+    def hierarchical_program(parameterization, data = "", generated = "", cross_validation = False):
+        likelihood = "T ~ normal(a[group] + b[group] .* diff, sigma);"
+        transformed = ""
+        if cross_validation:
+            data, transformed, generated = data + holdout_data, train_index, log_lik_hierarchical
+            likelihood = "T[train] ~ normal(a[group[train]] + b[group[train]] .* diff[train], sigma);"
+        
+        if parameterization == "non_centered":
+            parameters = """
+            vector[J] a_raw; // intercept offset
+            vector[J] b_raw; // slope offset
+        }
+        
+        transformed parameters {
+            vector[J] a = A + sigma_a * a_raw; // intercept
+            vector[J] b = B + sigma_b * b_raw; // slope
+        }
+        """
+            hierarchy = """
+            a_raw ~ std_normal();
+            b_raw ~ std_normal();"""
+        else:
+            parameters = """
+            vector[J] a; // intercept
+            vector[J] b; // slope
+        }
+        """
+            hierarchy = """
+            a ~ normal(A, sigma_a);
+            b ~ normal(B, sigma_b);"""
+        
+        return """
+        data {
+            int<lower=0> J; // number of groups
+            int<lower=0> N; // number of observations
+            array[N] int<lower=1, upper=J> group; // group indicator
+            vector[N] d18_O_w; // d18_O of water
+            vector[N] d18_O_c; // d18_O of carbon
+            vector[N] T; // temperature
+            """ + data + """
+        }
+        
+        transformed data {
+            vector[N] diff = d18_O_c - d18_O_w;""" + transformed + """
+        }
+        
+        parameters {
+            real<lower=-2, upper=50> A; // intercept
+            real B; // slope
+            real<lower=0> sigma; // standard deviation
+            real<lower=0> sigma_a; // intercept_std
+            real<lower=0> sigma_b; // slope_std""" + parameters + """
+        model {
+            A ~ uniform(-2, 50);
+            B ~ normal(0, 1);
+            sigma_a ~ normal(1, 1);
+            sigma_b ~ normal(0.5, 0.5);""" + hierarchy + """
+            
+            """ + likelihood + """
+        }
+        """ + generated
+    
+    prediction_data = """
+            int<lower=0> K; // number of new observations
+            int<lower=1, upper=J> specie; // species indicator
+            vector[K] d18_O_w_new; // new data
+            vector[K] d18_O_c_new; // new data"""
+    
+    prediction_data_b = prediction_data + """
+            real<lower=0> d18_O_c_std; // new data std
+            real<lower=0> d18_O_w_std; // new data std"""
+    
+    prediction = """
+        generated quantities {
+            vector[K] y_new = to_vector(normal_rng(a[specie] + b[specie] * (d18_O_c_new - d18_O_w_new), sigma));
+        }
+    """
+    
+    prediction_b = """
+        generated quantities {
+            vector[K] d18_O_c_s = to_vector(normal_rng(d18_O_c_new, d18_O_c_std));
+            vector[K] d18_O_w_s = to_vector(normal_rng(d18_O_w_new, d18_O_w_std));
+            vector[K] y_new = to_vector(normal_rng(a[specie] + b[specie] * (d18_O_c_s - d18_O_w_s), sigma));
+        }
+    """
+    
     stan_codes = {
        "Q1": stan_code_q1,
        "Q2": stan_code_q2,
@@ -241,6 +432,23 @@ def get_stan_code(question = "Q1"):
        "Q3_B": stan_code_q3_mix_pooling,
        "Q4_A": stan_code_q4,
        "Q4_B": stan_code_q4_b,
+       "Q1_collapsed": stan_code_collapsed,
+       "Q3_A_collapsed": stan_code_collapsed,
+       "Q3_B_collapsed": stan_code_q3_mix_pooling_collapsed,
     }
+    for variant in PARAMETERIZATIONS[1:]:
+        stan_codes["Q3_B_" + variant] = hierarchical_program(variant)
+        stan_codes["Q4_A_" + variant] = hierarchical_program(variant, data = prediction_data, generated = prediction)
+        stan_codes["Q4_B_" + variant] = hierarchical_program(variant, data = prediction_data_b, generated = prediction_b)
+    stan_codes["Q3_A_cv"] = stan_code_q3_cv
+    stan_codes["Q3_B_cv"] = hierarchical_program("vectorized", cross_validation = True)
+
+    return stan_codes[stan_question(question, parameterization)]
 
-    return stan_codes[question]
+def stan_question(question, parameterization = "centered"):
+    # registry name of a program variant, "Q3_B" in the non centered parameterization is "Q3_B_non_centered"
+    if parameterization == "centered":
+        return question
+    if parameterization not in PARAMETERIZATIONS or question not in HIERARCHICAL_QUESTIONS:
+        raise ValueError(f"No {parameterization} parameterization of {question}")
+    return question + "_" + parameterization
@@ -0,0 +1,100 @@
+# Copyright 2022 Cristian Grosu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+
+class RunningMoments:
+    # running count, mean and sum of squared deviations, one per entry of `shape`
+    def __init__(self, shape = ()):
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+
+    def update(self, block):
+        # the block holds the new values along the axes that follow `shape`
+        block = np.asarray(block, dtype = float)
+        axes = tuple(range(self.mean.ndim, block.ndim))
+        count = int(np.prod([block.shape[axis] for axis in axes]))
+        if count == 0:
+            return self
+        mean = block.mean(axis = axes)
+        m2 = ((block - np.expand_dims(mean, axes)) ** 2).sum(axis = axes)
+        return self._combine(count, mean, m2)
+
+    def merge(self, other):
+        if other.count == 0:
+            return self
+        return self._combine(other.count, other.mean, other.m2)
+
+    def _combine(self, count, mean, m2):
+        # Chan et al. pairwise update of the mean and of the sum of squared deviations
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * count / total
+        self.m2 = self.m2 + m2 + delta ** 2 * self.count * count / total
+        self.count = total
+        return self
+
+    @property
+    def variance(self):
+        # population variance, same convention as np.std
+        return self.m2 / self.count
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+class QuantileSketch:
+    # mergeable quantile sketch: every level keeps at most `capacity` values, each item of level i stands for 2**i samples
+    def __init__(self, capacity = 1024, rng = None):
+        self.capacity = capacity
+        self.rng = np.random.default_rng() if rng is None else rng
+        self.levels = [np.empty(0)]
+
+    def update(self, values):
+        self.levels[0] = np.concatenate((self.levels[0], np.ravel(values).astype(float)))
+        self._compact()
+        return self
+
+    def merge(self, other):
+        for level, items in enumerate(other.levels):
+            if level == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[level] = np.concatenate((self.levels[level], items))
+        self._compact()
+        return self
+
+    def _compact(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self.capacity:
+                items = np.sort(items)
+                # an odd item out stays on its level so the represented weight is preserved
+                leftover = items[len(items) - len(items) % 2:]
+                items = items[:len(items) - len(items) % 2]
+                promoted = items[self.rng.integers(2)::2]
+                self.levels[level] = leftover
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                self.levels[level + 1] = np.concatenate((self.levels[level + 1], promoted))
+            level += 1
+
+    def quantiles(self, qs):
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), 2.0 ** level) for level, items in enumerate(self.levels)])
+        order = np.argsort(values)
+        cumulative = np.cumsum(weights[order])
+        positions = np.searchsorted(cumulative, np.asarray(qs) * cumulative[-1])
+        return values[order][np.minimum(positions, len(values) - 1)]
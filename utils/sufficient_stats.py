@@ -0,0 +1,109 @@
+# Copyright 2022 Cristian Grosu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from concurrent.futures import ProcessPoolExecutor
+import io
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from utils.dataset import _cache_folder, _file_hash
+from utils.fileio import atomic_write
+
+STATS = ["n", "sx", "sxx", "sy", "sxy", "syy"]
+COLS = ["species", "temperature", "d18_O_w", "d18_O"]
+
+def sufficient_statistics(data_df) -> pd.DataFrame:
+    # per species n, sum x, sum x^2, sum y, sum xy, sum y^2 with x = d18_O_c - d18_O_w and y the temperature
+    x = np.asarray(data_df["d18_O"], dtype = float) - np.asarray(data_df["d18_O_w"], dtype = float)
+    y = np.asarray(data_df["temperature"], dtype = float)
+    terms = pd.DataFrame({"n": 1.0, "sx": x, "sxx": x * x, "sy": y, "sxy": x * y, "syy": y * y}, index = pd.Index(np.asarray(data_df["species"], dtype = object), name = "species"))
+    return terms.groupby(level = 0, sort = False).sum()
+
+def combine_statistics(partials) -> pd.DataFrame:
+    # species keep the order in which they first appear across the partial results
+    return pd.concat(partials).groupby(level = 0, sort = False).sum()
+
+def compute_sufficient_statistics(filename, workers = None, chunk_size = 2**26, use_cache = True) -> pd.DataFrame:
+    # splits the file in byte ranges of about chunk_size that start and end on line boundaries (fields must not contain newlines),
+    # every worker parses and reduces its ranges so the whole file is never held in memory;
+    # the result is cached next to the dataset cache of the file and reused while the file is unchanged
+    if use_cache:
+        stats = _read_cached_statistics(filename)
+        if stats is not None:
+            return stats
+    stats = _reduce_file(filename, workers, chunk_size)
+    if use_cache:
+        _write_cached_statistics(filename, stats)
+    return stats
+
+def _reduce_file(filename, workers, chunk_size):
+    with open(filename, "rb") as f:
+        header = f.readline()
+        names = header.decode("utf-8").strip().split(",")
+        size = os.fstat(f.fileno()).st_size
+
+        boundaries = [len(header)]
+        while boundaries[-1] < size:
+            f.seek(min(boundaries[-1] + chunk_size, size))
+            f.readline()
+            boundaries.append(min(f.tell(), size))
+
+    ranges = [(filename, start, end, names) for start, end in zip(boundaries[:-1], boundaries[1:]) if end > start]
+    if not ranges:
+        return pd.DataFrame(columns = STATS)
+    if workers == 1 or len(ranges) == 1:
+        partials = [_reduce_range(args) for args in ranges]
+    else:
+        with ProcessPoolExecutor(max_workers = workers) as executor:
+            partials = list(executor.map(_reduce_range, ranges))
+    return combine_statistics(partials)
+
+def _cache_path(filename):
+    return os.path.join(_cache_folder(filename), "sufficient_stats.json")
+
+def _read_cached_statistics(filename):
+    if not os.path.exists(_cache_path(filename)):
+        return None
+    with open(_cache_path(filename), "r") as f:
+        cached = json.load(f)
+    stat = os.stat(filename)
+    if cached["size"] != stat.st_size or (cached["mtime"] != stat.st_mtime and cached["sha256"] != _file_hash(filename)):
+        return None
+    return pd.DataFrame(cached["stats"], index = pd.Index(cached["species"], name = "species"), columns = STATS)
+
+def _write_cached_statistics(filename, stats):
+    # one file holds the statistics with the state of the csv they were computed from, replaced atomically so
+    # concurrent processes never read a partial or mismatched cache
+    stat = os.stat(filename)
+    cached = {"mtime": stat.st_mtime, "size": stat.st_size, "sha256": _file_hash(filename), "species": [str(specie) for specie in stats.index], "stats": {col: stats[col].tolist() for col in STATS}}
+    atomic_write(_cache_path(filename), json.dumps(cached))
+
+def _reduce_range(args):
+    filename, start, end, names = args
+    with open(filename, "rb") as f:
+        f.seek(start)
+        block = f.read(end - start)
+    data_df = pd.read_csv(io.BytesIO(block), header = None, names = names, usecols = COLS)
+    return sufficient_statistics(data_df)
+
+def get_collapsed_data(stats):
+    # one row (Q1, Q3_A) or one row per species (Q3_B)
+    if isinstance(stats, pd.Series):
+        return {stat: float(stats[stat]) for stat in STATS}
+    data = {stat: stats[stat].to_numpy() for stat in STATS}
+    data["J"] = len(stats)
+    return data
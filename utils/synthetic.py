@@ -0,0 +1,101 @@
+# Copyright 2022 Cristian Grosu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import json
+
+import numpy as np
+import pandas as pd
+
+COLUMNS = ["ID", "paper", "location", "species", "temperature", "d18_O_w", "d18_O", "d18_O_sd", "d18_O_w_sd", "class", "functional_group", "composition"]
+
+# hyperparameters of the Q3_B fit on data/merged_data.csv
+HYPERPARAMETERS = {"A": 18.398, "B": -4.637, "sigma": 2.191, "sigma_a": 1.429, "sigma_b": 0.478}
+
+def generate_dataset(file_name, num_rows, num_species, imbalance = 0.0, measurement_error = True, chunk_size = 10**6, seed = 0, hyperparameters = None):
+    # simulates the Q3_B model with measurement noise on d18_O and d18_O_w, written chunk by chunk with the merged_data.csv columns;
+    # the species frequencies decay as 1 / rank**imbalance, 0 gives balanced species.
+    # Every column draws from its own stream spawned from the seed, so the rows do not depend on chunk_size
+    params = dict(HYPERPARAMETERS, **(hyperparameters or {}))
+    rng, *streams = [np.random.default_rng(stream) for stream in np.random.SeedSequence(seed).spawn(9)]
+    group_rng, d18_O_w_rng, delta_rng, noise_rng, d18_O_sd_rng, d18_O_w_sd_rng, d18_O_error_rng, d18_O_w_error_rng = streams
+
+    a = rng.normal(params["A"], params["sigma_a"], size = num_species)
+    b = rng.normal(params["B"], params["sigma_b"], size = num_species)
+    species = np.array([f"Synthetic species {j + 1}" for j in range(num_species)])
+    functional_group = np.where(np.arange(num_species) % 2 == 0, "benthos", "plankton")
+    probabilities = 1 / np.arange(1, num_species + 1) ** imbalance
+    probabilities /= probabilities.sum()
+
+    counts = np.zeros(num_species, dtype = int)
+    for start in range(0, num_rows, chunk_size):
+        size = min(chunk_size, num_rows - start)
+        group = group_rng.choice(num_species, size = size, p = probabilities)
+        counts += np.bincount(group, minlength = num_species)
+
+        # true isotope values and the temperature they imply
+        d18_O_w = d18_O_w_rng.normal(0.3, 0.6, size = size)
+        delta = delta_rng.uniform(-1, 3.5, size = size)
+        temperature = a[group] + b[group] * delta + noise_rng.normal(0, params["sigma"], size = size)
+
+        # the measured values deviate from the true ones by the reported standard deviations
+        d18_O_sd = d18_O_sd_rng.uniform(0.05, 0.15, size = size)
+        d18_O_w_sd = d18_O_w_sd_rng.uniform(0.1, 0.2, size = size)
+        d18_O = d18_O_w + delta
+        if measurement_error:
+            d18_O = d18_O + d18_O_error_rng.normal(0, d18_O_sd)
+            d18_O_w = d18_O_w + d18_O_w_error_rng.normal(0, d18_O_w_sd)
+
+        chunk = pd.DataFrame({
+            "ID": np.arange(start, start + size),
+            "paper": "Synthetic",
+            "location": "Synthetic",
+            "species": species[group],
+            "temperature": temperature,
+            "d18_O_w": d18_O_w,
+            "d18_O": d18_O,
+            "d18_O_sd": d18_O_sd,
+            "d18_O_w_sd": d18_O_w_sd,
+            "class": "foraminifera",
+            "functional_group": functional_group[group],
+            "composition": "Calcite",
+        }, columns = COLUMNS)
+        chunk.to_csv(file_name, mode = "w" if start == 0 else "a", header = start == 0, index = False, float_format = "%.4f")
+
+    truth = {
+        "num_rows": num_rows,
+        "num_species": num_species,
+        "imbalance": imbalance,
+        "measurement_error": measurement_error,
+        "seed": seed,
+        "hyperparameters": params,
+        "species": {name: {"a": a[j], "b": b[j], "count": int(counts[j])} for j, name in enumerate(species)},
+    }
+    with open(file_name + ".params.json", "w") as f:
+        json.dump(truth, f, indent = 2)
+    return truth
+
+def main():
+    parser = argparse.ArgumentParser(description = "Writes a synthetic dataset with the merged_data.csv columns")
+    parser.add_argument("file_name")
+    parser.add_argument("--rows", type = int, default = 10**5)
+    parser.add_argument("--species", type = int, default = 11)
+    parser.add_argument("--imbalance", type = float, default = 0.0)
+    parser.add_argument("--no-measurement-error", action = "store_true")
+    parser.add_argument("--seed", type = int, default = 0)
+    args = parser.parse_args()
+    generate_dataset(args.file_name, args.rows, args.species, imbalance = args.imbalance, measurement_error = not args.no_measurement_error, seed = args.seed)
+
+if __name__ == "__main__":
+    main()
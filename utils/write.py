@@ -12,18 +12,40 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
 import os
 
+import numpy as np
+
+DESCRIBE_ROWS = ["count", "mean", "std", "min", "25%", "50%", "75%", "max"]
+
 def write_results(fit, file_name = "results.txt", cols = ["a", "b", "sigma"], folder = "Q1", described = False):
     os.makedirs(os.path.join("results", folder), exist_ok = True)
     file_name = os.path.join("results", folder, file_name)
     
     if not described:
-        fit = fit.describe()
+        fit = fit[cols].describe()
         
-    results = fit[cols]
+    fit[cols].to_csv(file_name, sep = ",", index = True, float_format = "%.3f")
+
+def write_draws(fit, cols = None, folder = "Q1", num_chains = 1, store_name = "draws"):
+    # one (chains, draws) .npy file per parameter so readers can memory map only the columns they need,
+    # the rows of fit follow the fit.to_frame() order: draw after draw, chains interleaved
+    store = os.path.join("results", folder, store_name)
+    os.makedirs(store, exist_ok = True)
+    
+    if cols is None:
+        cols = list(fit.columns)
+    num_draws = len(fit) // num_chains
     for col in cols:
-        vals = results.loc[:, col]
-        vals = vals.apply(lambda x: "{:.3f}".format(x))
-        results.loc[:, col] = vals
-    results.to_csv(file_name, sep = ",", index = True)
\ No newline at end of file
+        values = np.ascontiguousarray(np.asarray(fit[col], dtype = float).reshape(num_draws, num_chains).T)
+        np.save(os.path.join(store, col + ".npy"), values)
+    
+    meta = {"params": list(cols), "num_chains": num_chains, "num_draws": num_draws, "dtype": "float64"}
+    with open(os.path.join(store, "meta.json"), "w") as f:
+        json.dump(meta, f, indent = 2)
+    return store
+
+def write_summary(summary, file_name = "results.txt", cols = ["a", "b", "sigma"], folder = "Q1"):
+    # results.txt keeps the DataFrame.describe() layout, taken from the rows of a diagnostics summary
+    write_results(summary.loc[cols, DESCRIBE_ROWS].T, file_name = file_name, cols = cols, folder = folder, described = True)